@@ -0,0 +1,87 @@
+import threading
+from datetime import datetime
+from BookingSystem import BookingSystem
+from NotificationSystem import NotificationSystem
+
+
+class AttendanceSweeper:
+    """Background job that applies the late/no-show rules as session marks pass.
+
+    Each tick only looks at sessions whose 15- or 30-minute mark was crossed
+    since the persisted watermark, so its cost does not grow with history.
+    """
+
+    def __init__(self, booking_system=None, notification_system=None, clock=datetime.now,
+                 interval=60, name='attendance_sweeper'):
+        self.booking_system = booking_system or BookingSystem()
+        self.db = self.booking_system.db
+        self.notification_system = notification_system
+        self.clock = clock
+        self.interval = interval
+        self.name = name
+        self._stop = threading.Event()
+        self._thread = None
+
+    def get_watermark(self):
+        """Return the moment the last completed sweep ran up to, if any"""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT watermark FROM job_state WHERE name = ?', (self.name,))
+            row = cursor.fetchone()
+            return datetime.fromisoformat(row[0]) if row else None
+
+    def run_once(self):
+        """Sweep everything that became late or a no-show since the watermark"""
+        now = self.clock()
+        with self.db.transaction() as conn:
+            since = self.get_watermark()
+            if since is not None and since >= now:
+                return {'late': [], 'no_show': [], 'promoted': []}
+
+            result = self.booking_system.check_late_arrivals(now, since=since)
+            # Advance the watermark in the same transaction as the updates
+            conn.execute('''
+                INSERT INTO job_state (name, watermark) VALUES (?, ?)
+                ON CONFLICT(name) DO UPDATE SET watermark = excluded.watermark
+            ''', (self.name, now.isoformat()))
+
+        if self.notification_system:
+            self.notification_system.notify_sweep(result)
+        return result
+
+    def run_forever(self):
+        """Tick every `interval` seconds until stop() is called"""
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Attendance sweep failed: {str(e)}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Run the sweeper on a daemon thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run_forever, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+if __name__ == "__main__":
+    booking_system = BookingSystem()
+    notification_system = NotificationSystem(db=booking_system.db)
+    sweeper = AttendanceSweeper(booking_system, notification_system)
+    # Offers made by the sweep expire on the engine's own, finer-grained timer
+    booking_system.waiting_list.notification_system = notification_system
+    booking_system.waiting_list.start()
+    try:
+        sweeper.run_forever()
+    except KeyboardInterrupt:
+        sweeper.stop()
+        booking_system.waiting_list.stop()
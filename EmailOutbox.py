@@ -0,0 +1,253 @@
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from database import Database
+
+# A message claimed longer ago than this is assumed abandoned by a crashed worker
+CLAIM_LEASE_SECONDS = 600
+
+
+class EmailOutbox:
+    """Durable email queue drained by a pool of workers.
+
+    Callers only insert a row; each worker keeps one SMTP session open and
+    reuses it for every message it sends. Failed messages are retried with
+    exponential backoff until max_attempts is reached.
+
+    NotificationSystem only enqueues, so nothing is sent unless a worker
+    pool is running, normally as its own `python EmailOutbox.py cfg.json`
+    process. Claims are leased: a message still 'sending' after
+    `lease` seconds is put back in the queue, so several worker processes
+    can share the table and restarting one does not resend another's batch.
+    """
+
+    def __init__(self, email_config, db=None, workers=2, batch_size=20, max_attempts=5,
+                 backoff=30, poll_interval=1.0, lease=CLAIM_LEASE_SECONDS, smtp_factory=smtplib.SMTP):
+        self.email_config = email_config
+        self.db = db or Database()
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self._recover_at = 0.0  # Monotonic time of the next sweep for expired claims
+        self.smtp_factory = smtp_factory
+        self._stop = threading.Event()
+        self._threads = []
+        self._stats_lock = threading.Lock()
+        self.stats = {'sent': 0, 'retried': 0, 'failed': 0, 'busy_seconds': 0.0}
+
+    def enqueue(self, to_email, subject, message):
+        """Queue an email for delivery and return its outbox id"""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO email_outbox (to_email, subject, body, next_attempt_at)
+                VALUES (?, ?, ?, ?)
+            ''', (to_email, subject, message, datetime.now().isoformat(' ')))
+            return cursor.lastrowid
+
+    def enqueue_many(self, emails):
+        """Queue (to_email, subject, message) tuples in one statement"""
+        now = datetime.now().isoformat(' ')
+        with self.db.get_connection() as conn:
+            conn.executemany('''
+                INSERT INTO email_outbox (to_email, subject, body, next_attempt_at)
+                VALUES (?, ?, ?, ?)
+            ''', [(to_email, subject, message, now) for to_email, subject, message in emails])
+
+    def claim(self):
+        """Atomically take up to batch_size due messages for one worker"""
+        now = datetime.now().isoformat(' ')
+        with self.db.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, to_email, subject, body, attempts
+                FROM email_outbox
+                WHERE status = 'pending' AND next_attempt_at <= ?
+                ORDER BY next_attempt_at
+                LIMIT ?
+            ''', (now, self.batch_size))
+            rows = cursor.fetchall()
+            cursor.executemany(
+                "UPDATE email_outbox SET status = 'sending', claimed_at = ? WHERE id = ?",
+                [(now, row[0]) for row in rows]
+            )
+            return rows
+
+    def recover(self):
+        """Return messages whose claim has outlived the lease, left by a crashed worker, to the queue"""
+        expired = (datetime.now() - timedelta(seconds=self.lease)).isoformat(' ')
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            # Claims made before claimed_at existed have no time and count as expired
+            cursor.execute('''
+                UPDATE email_outbox SET status = 'pending', claimed_at = NULL
+                WHERE status = 'sending' AND (claimed_at IS NULL OR claimed_at < ?)
+            ''', (expired,))
+            return cursor.rowcount
+
+    def connect(self):
+        server = self.smtp_factory(self.email_config['smtp_server'], self.email_config['smtp_port'])
+        if self.email_config.get('use_tls'):
+            server.starttls()
+        if self.email_config.get('username'):
+            server.login(self.email_config['username'], self.email_config['password'])
+        return server
+
+    def _build_message(self, to_email, subject, body):
+        msg = MIMEMultipart()
+        msg['From'] = self.email_config['sender']
+        msg['To'] = to_email
+        msg['Subject'] = subject
+        msg.attach(MIMEText(body, 'plain'))
+        return msg
+
+    def _deliver(self, server, msg):
+        """Send over the worker's session, reconnecting once if it was dropped"""
+        if server is None:
+            server = self.connect()
+        try:
+            server.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            server = self.connect()
+            server.send_message(msg)
+        return server
+
+    def _record(self, sent, failures):
+        now = datetime.now()
+        retries, dead = [], []
+        for outbox_id, attempts, error in failures:
+            attempts += 1
+            if attempts >= self.max_attempts:
+                dead.append((attempts, error, outbox_id))
+            else:
+                retry_at = now + timedelta(seconds=self.backoff * 2 ** (attempts - 1))
+                retries.append((attempts, retry_at.isoformat(' '), error, outbox_id))
+
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                UPDATE email_outbox
+                SET status = 'sent', attempts = attempts + 1, sent_at = ?
+                WHERE id = ?
+            ''', [(now.isoformat(' '), outbox_id) for outbox_id in sent])
+            cursor.executemany('''
+                UPDATE email_outbox
+                SET status = 'pending', attempts = ?, next_attempt_at = ?, last_error = ?
+                WHERE id = ?
+            ''', retries)
+            cursor.executemany('''
+                UPDATE email_outbox
+                SET status = 'failed', attempts = ?, last_error = ?
+                WHERE id = ?
+            ''', dead)
+
+        with self._stats_lock:
+            self.stats['sent'] += len(sent)
+            self.stats['retried'] += len(retries)
+            self.stats['failed'] += len(dead)
+
+    def process_batch(self, server=None):
+        """Send one claimed batch; returns (messages handled, SMTP session to reuse)"""
+        rows = self.claim()
+        if not rows:
+            return 0, server
+
+        start = time.perf_counter()
+        sent, failures = [], []
+        for outbox_id, to_email, subject, body, attempts in rows:
+            try:
+                server = self._deliver(server, self._build_message(to_email, subject, body))
+                sent.append(outbox_id)
+            except Exception as e:
+                print(f"Failed to send email: {str(e)}")
+                failures.append((outbox_id, attempts, str(e)))
+                server = self._close(server)
+        self._record(sent, failures)
+
+        with self._stats_lock:
+            self.stats['busy_seconds'] += time.perf_counter() - start
+        return len(rows), server
+
+    def drain(self):
+        """Send everything currently due on the calling thread"""
+        server = None
+        try:
+            while True:
+                handled, server = self.process_batch(server)
+                if not handled:
+                    break
+        finally:
+            self._close(server)
+
+    @staticmethod
+    def _close(server):
+        if server is not None:
+            try:
+                server.quit()
+            except Exception:
+                pass
+        return None
+
+    def _worker(self):
+        server = None
+        try:
+            while not self._stop.is_set():
+                try:
+                    handled, server = self.process_batch(server)
+                    # Pick up claims abandoned by a worker process that died while this one runs
+                    if not handled and time.monotonic() >= self._recover_at:
+                        self._recover_at = time.monotonic() + self.lease / 2
+                        self.recover()
+                except Exception as e:
+                    print(f"Email outbox worker error: {str(e)}")
+                    handled = 0
+                if not handled:
+                    self._stop.wait(self.poll_interval)
+        finally:
+            self._close(server)
+
+    def start(self):
+        """Start the worker pool on daemon threads"""
+        self.recover()
+        self._recover_at = time.monotonic() + self.lease / 2
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"email-outbox-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def throughput(self):
+        """Emails sent per second of worker time spent sending"""
+        with self._stats_lock:
+            busy = self.stats['busy_seconds']
+            return self.stats['sent'] / busy if busy else 0.0
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+
+    # Usage: python EmailOutbox.py email_config.json
+    # Run this alongside the web app and CLI; they only queue emails, this process sends them
+    with open(sys.argv[1]) as f:
+        outbox = EmailOutbox(json.load(f))
+    outbox.start()
+    try:
+        while True:
+            time.sleep(60)
+            print(f"Sent {outbox.stats['sent']} emails ({outbox.throughput():.1f}/s), "
+                  f"{outbox.stats['failed']} failed")
+    except KeyboardInterrupt:
+        outbox.stop()
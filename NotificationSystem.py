@@ -1,142 +1,175 @@
 from datetime import datetime
+from string import Template
 from database import Database
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from EmailOutbox import EmailOutbox
+from timecodes import format_minutes, from_day
 
-class NotificationSystem:
-    def __init__(self, email_config=None):
-        self.db = Database()
-        self.email_config = email_config or {}
-        self.notifications = []
-
-    def send_email(self, to_email, subject, message):
-        """Send email notification if email configuration is available"""
-        if not self.email_config:
-            print(f"Email notification would be sent to {to_email}: {subject}")
-            return
-
-        try:
-            msg = MIMEMultipart()
-            msg['From'] = self.email_config['sender']
-            msg['To'] = to_email
-            msg['Subject'] = subject
-
-            msg.attach(MIMEText(message, 'plain'))
-
-            with smtplib.SMTP(self.email_config['smtp_server'], self.email_config['smtp_port']) as server:
-                if self.email_config.get('use_tls'):
-                    server.starttls()
-                server.login(self.email_config['username'], self.email_config['password'])
-                server.send_message(msg)
-        except Exception as e:
-            print(f"Failed to send email: {str(e)}")
-            self.log_notification(to_email, subject, message, 'failed')
-
-    def notify_booking_confirmation(self, player_id, session_info):
-        """Send booking confirmation notification"""
-        with self.db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT email, name FROM players WHERE id = ?', (player_id,))
-            player = cursor.fetchone()
-            
-            if player:
-                email, name = player
-                subject = "Court Booking Confirmation"
-                message = f"""
-                Dear {name},
+# Precompiled message templates: notification type -> (subject, body)
+TEMPLATES = {
+    'booking_confirmation': ("Court Booking Confirmation", Template("""
+                Dear $name,
 
                 Your court booking has been confirmed:
-                Court: {session_info['court']}
-                Date: {session_info['date']}
-                Time: {session_info['start_time']} - {session_info['end_time']}
+                Court: $court
+                Date: $date
+                Time: $start_time - $end_time
 
                 Please arrive at least 5 minutes before your session.
                 Remember:
                 - Late arrival (>15 minutes) will result in a warning
-                - Three warnings will result in a $25 fine
-                - No-shows will be fined $25
+                - Three warnings will result in a $$25 fine
+                - No-shows will be fined $$25
 
                 Thank you for choosing Lifetime Gym!
-                """
-                self.send_email(email, subject, message)
-                self.log_notification(player_id, 'booking_confirmation', message)
-
-    def notify_late_warning(self, player_id):
-        """Send late arrival warning notification"""
-        with self.db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT email, name, warnings 
-                FROM players 
-                WHERE id = ?
-            ''', (player_id,))
-            player = cursor.fetchone()
-            
-            if player:
-                email, name, warnings = player
-                subject = "Late Arrival Warning"
-                message = f"""
-                Dear {name},
+                """)),
+    'late_warning': ("Late Arrival Warning", Template("""
+                Dear $name,
 
                 This is a warning notification for arriving more than 15 minutes late to your court session.
-                Current warnings: {warnings}/3
+                Current warnings: $warnings/3
 
-                Please note that three warnings will result in a $25 fine.
+                Please note that three warnings will result in a $$25 fine.
 
                 Thank you for your understanding.
-                """
-                self.send_email(email, subject, message)
-                self.log_notification(player_id, 'late_warning', message)
+                """)),
+    'fine_notice': ("Fine Notice", Template("""
+                Dear $name,
 
-    def notify_fine(self, player_id, reason):
-        """Send fine notification"""
-        with self.db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT email, name, fines FROM players WHERE id = ?', (player_id,))
-            player = cursor.fetchone()
-            
-            if player:
-                email, name, fines = player
-                subject = "Fine Notice"
-                message = f"""
-                Dear {name},
-
-                You have been fined $25 for: {reason}
-                Total outstanding fines: ${fines}
+                You have been fined $$25 for: $reason
+                Total outstanding fines: $$$fines
 
                 Please settle your fines at the front desk.
 
                 Thank you for your understanding.
-                """
-                self.send_email(email, subject, message)
-                self.log_notification(player_id, 'fine_notice', message)
-
-    def notify_waiting_list_spot(self, player_id, session_info):
-        """Notify player about available spot from waiting list"""
-        with self.db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT email, name FROM players WHERE id = ?', (player_id,))
-            player = cursor.fetchone()
-            
-            if player:
-                email, name = player
-                subject = "Court Spot Available"
-                message = f"""
-                Dear {name},
+                """)),
+    'waiting_list_notification': ("Court Spot Available", Template("""
+                Dear $name,
 
                 A spot has become available for your wait-listed session:
-                Court: {session_info['court']}
-                Date: {session_info['date']}
-                Time: {session_info['start_time']} - {session_info['end_time']}
+                Court: $court
+                Date: $date
+                Time: $start_time - $end_time
 
                 Please confirm your attendance within the next 5 minutes.
                 Regular attendance rules apply.
 
                 Thank you for choosing Lifetime Gym!
-                """
-                self.send_email(email, subject, message)
-                self.log_notification(player_id, 'waiting_list_notification', message)
+                """)),
+}
+
+# Largest IN (...) list per player lookup
+LOOKUP_CHUNK = 500
+
+
+class NotificationSystem:
+    def __init__(self, email_config=None, db=None):
+        self.db = db or Database()
+        self.email_config = email_config or {}
+        self.outbox = EmailOutbox(self.email_config, self.db) if self.email_config else None
+        self.notifications = []
+
+    def send_email(self, to_email, subject, message):
+        """Queue email notification if email configuration is available"""
+        if not self.email_config:
+            print(f"Email notification would be sent to {to_email}: {subject}")
+            return
+
+        # Delivery happens on the outbox workers, off the caller's request path
+        self.outbox.enqueue(to_email, subject, message)
+
+    def notify_booking_confirmation(self, player_id, session_info):
+        """Send booking confirmation notification"""
+        self.notify_many([(player_id, 'booking_confirmation', session_info)])
+
+    def notify_late_warning(self, player_id):
+        """Send late arrival warning notification"""
+        self.notify_many([(player_id, 'late_warning')])
+
+    def notify_fine(self, player_id, reason):
+        """Send fine notification"""
+        self.notify_many([(player_id, 'fine_notice', {'reason': reason})])
+
+    def notify_waiting_list_spot(self, player_id, session_info):
+        """Notify player about available spot from waiting list"""
+        self.notify_many([(player_id, 'waiting_list_notification', session_info)])
+
+    def notify_many(self, events):
+        """Send a batch of notifications with one player lookup and one log insert.
+
+        `events` holds (player_id, type) or (player_id, type, params) tuples,
+        where type is a TEMPLATES key and params fills the template.
+        """
+        players = self._load_players({event[0] for event in events})
+
+        emails, log_rows = [], []
+        now = datetime.now()
+        for event in events:
+            player_id, notification_type = event[0], event[1]
+            player = players.get(player_id)
+            if player is None:
+                continue
+            subject, template = TEMPLATES[notification_type]
+            message = template.substitute(player, **(event[2] if len(event) > 2 else {}))
+            emails.append((player['email'], subject, message))
+            log_rows.append((player_id, notification_type, message, 'sent', now))
+
+        if self.email_config:
+            self.outbox.enqueue_many(emails)
+        else:
+            for to_email, subject, message in emails:
+                self.send_email(to_email, subject, message)
+
+        with self.db.get_connection() as conn:
+            conn.executemany('''
+                INSERT INTO notifications (player_id, type, message, status, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', log_rows)
+        return len(log_rows)
+
+    def _load_players(self, player_ids):
+        """Fetch email, name, warnings and fines for many players with IN queries"""
+        player_ids = list(player_ids)
+        players = {}
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            for i in range(0, len(player_ids), LOOKUP_CHUNK):
+                chunk = player_ids[i:i + LOOKUP_CHUNK]
+                cursor.execute(f'''
+                    SELECT id, email, name, warnings, fines
+                    FROM players
+                    WHERE id IN ({','.join('?' * len(chunk))})
+                ''', chunk)
+                for player_id, email, name, warnings, fines in cursor.fetchall():
+                    players[player_id] = {'email': email, 'name': name,
+                                          'warnings': warnings, 'fines': fines}
+        return players
+
+    def notify_sweep(self, result):
+        """Fan out the warnings, fines and offers from one attendance sweep"""
+        events = [(player_id, 'late_warning') for player_id in result['late']]
+        events += [(player_id, 'fine_notice', {'reason': "No-show"}) for player_id in result['no_show']]
+
+        sessions = self._load_sessions({session_id for _, session_id in result['promoted']})
+        events += [(player_id, 'waiting_list_notification', sessions[session_id])
+                   for player_id, session_id in result['promoted']]
+        return self.notify_many(events) if events else 0
+
+    def _load_sessions(self, session_ids):
+        """Court, date and times for the given sessions, keyed by session id"""
+        if not session_ids:
+            return {}
+        session_ids = list(session_ids)
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT s.id, c.court_number, s.day, s.start_minute, s.end_minute
+                FROM sessions s
+                JOIN courts c ON s.court_id = c.id
+                WHERE s.id IN ({','.join('?' * len(session_ids))})
+            ''', session_ids)
+            return {session_id: {'court': court, 'date': str(from_day(day)),
+                                 'start_time': format_minutes(start), 'end_time': format_minutes(end)}
+                    for session_id, court, day, start, end in cursor.fetchall()}
 
     def log_notification(self, player_id, notification_type, message, status='sent'):
         """Log all notifications in the database"""
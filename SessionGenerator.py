@@ -0,0 +1,84 @@
+import threading
+from datetime import date, datetime, timedelta
+from database import Database
+from schedule import BOOKING_WINDOW_DAYS, time_slots
+
+
+class SessionGenerator:
+    """Background job that keeps every court x slot session of the booking window in place.
+
+    Each run creates the sessions for the dates that entered the window since
+    the persisted watermark, so bookings only ever look sessions up.
+    """
+
+    def __init__(self, db=None, clock=datetime.now, horizon_days=BOOKING_WINDOW_DAYS,
+                 interval=3600, name='session_generator'):
+        self.db = db or Database()
+        self.clock = clock
+        self.horizon_days = horizon_days
+        self.interval = interval
+        self.name = name
+        self._stop = threading.Event()
+        self._thread = None
+
+    def get_watermark(self):
+        """Return the last date sessions were generated up to, if any"""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT watermark FROM job_state WHERE name = ?', (self.name,))
+            row = cursor.fetchone()
+            return date.fromisoformat(row[0]) if row else None
+
+    def run_once(self, full=False):
+        """Generate sessions up to the end of the horizon; returns how many were created.
+
+        With `full`, the whole window is filled again, e.g. after adding courts.
+        """
+        today = self.clock().date()
+        last = today + timedelta(days=self.horizon_days)
+        with self.db.transaction() as conn:
+            watermark = None if full else self.get_watermark()
+            first = today if watermark is None else max(today, watermark + timedelta(days=1))
+            if first > last:
+                return 0
+
+            dates = [first + timedelta(days=offset) for offset in range((last - first).days + 1)]
+            created = self.db.generate_sessions(dates, time_slots())
+            conn.execute('''
+                INSERT INTO job_state (name, watermark) VALUES (?, ?)
+                ON CONFLICT(name) DO UPDATE SET watermark = excluded.watermark
+            ''', (self.name, last.isoformat()))
+        return created
+
+    def run_forever(self):
+        """Tick every `interval` seconds until stop() is called"""
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+                # Housekeeping: the change feed only needs its recent events
+                self.db.prune_booking_events()
+            except Exception as e:
+                print(f"Session generation failed: {str(e)}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Run the generator on a daemon thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run_forever, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+if __name__ == "__main__":
+    generator = SessionGenerator()
+    try:
+        generator.run_forever()
+    except KeyboardInterrupt:
+        generator.stop()
@@ -1,25 +1,30 @@
 from datetime import datetime, timedelta
 from BookingSystem import BookingSystem
 from NotificationSystem import NotificationSystem
+from SessionGenerator import SessionGenerator
 from database import Database
+from hashing import hasher
+from metrics import metrics
+from schedule import BOOKING_WINDOW_DAYS, MAX_SERIES_WEEKS, time_slots
+import atexit
 import re
+import sys
 import calendar
+import itertools
 from tabulate import tabulate
 import colorama
 from colorama import Fore, Back, Style
 
 class UserInterface:
-    def __init__(self):
-        self.booking_system = BookingSystem()
-        self.notification_system = NotificationSystem()
-        self.db = Database()
+    def __init__(self, db=None):
+        self.db = db or Database()
+        self.booking_system = BookingSystem(self.db)
+        self.repository = self.booking_system.repository
+        self.notification_system = NotificationSystem(db=self.db)
+        self.session_generator = SessionGenerator(self.db)
         self.current_user = None
         colorama.init()
-        self.time_slots = [
-            "07:00-09:00", "09:00-11:00", "11:00-13:00",
-            "13:00-15:00", "15:00-17:00", "17:00-19:00",
-            "19:00-21:00", "21:00-23:00"
-        ]
+        self.time_slots = [f"{start}-{end}" for start, end in time_slots()]
 
     def validate_email(self, email):
         """Validate email format"""
@@ -38,15 +43,12 @@ class UserInterface:
         while True:
             email = input("Enter your email: ").strip()
             # Check if email exists before proceeding
-            with self.db.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute('SELECT COUNT(*) FROM players WHERE email = ?', (email,))
-                if cursor.fetchone()[0] > 0:
-                    print(f"\nEmail {email} is already registered.")
-                    choice = input("Would you like to: \n1. Login\n2. Try a different email\nChoice (1/2): ")
-                    if choice == '1':
-                        return self.login()
-                    continue
+            if self.repository.find_account(email):
+                print(f"\nEmail {email} is already registered.")
+                choice = input("Would you like to: \n1. Login\n2. Try a different email\nChoice (1/2): ")
+                if choice == '1':
+                    return self.login()
+                continue
 
             if self.validate_email(email):
                 break
@@ -58,8 +60,11 @@ class UserInterface:
                 break
             print("Password must be at least 6 characters")
 
+        # Hash before the unit of work, which holds the database write lock until it ends
+        password_hash = hasher.hash(password)
         try:
-            player_id = self.db.add_player(name, email, password)
+            with self.repository.unit_of_work() as uow:
+                player_id = uow.add_player(name, email, password_hash)
             print("Registration successful!")
             self.current_user = {
                 'id': player_id,
@@ -77,26 +82,24 @@ class UserInterface:
         email = input("Email: ").strip()
         password = input("Password: ")
 
-        with self.db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id, name, email 
-                FROM players 
-                WHERE email = ? AND password = ?
-            ''', (email, password))
-            user = cursor.fetchone()
-
-            if user:
-                self.current_user = {
-                    'id': user[0],
-                    'name': user[1],
-                    'email': user[2]
-                }
-                print(f"Welcome back, {user[1]}!")
-                return True
-            else:
-                print("Invalid email or password")
-                return False
+        user = self.repository.find_account(email)
+        ok, new_hash = hasher.verify(user[3], password) if user else (False, None)
+        if new_hash:
+            # Replace legacy plaintext or outdated hashes on successful login
+            with self.repository.unit_of_work() as uow:
+                uow.set_password(user[0], new_hash)
+
+        if ok:
+            self.current_user = {
+                'id': user[0],
+                'name': user[1],
+                'email': user[2]
+            }
+            print(f"Welcome back, {user[1]}!")
+            return True
+        else:
+            print("Invalid email or password")
+            return False
 
     def display_menu(self):
         """Display main menu"""
@@ -110,8 +113,11 @@ class UserInterface:
             print("2. View My Bookings")
             print("3. View Available Sessions")
             print("4. View My Warnings and Fines")
-            print("5. Logout")
-            print("6. Exit")
+            print("5. Find Earliest Available Slots")
+            print("6. Respond to Waiting-List Offers")
+            print("7. Book a Series of Sessions")
+            print("8. Logout")
+            print("9. Exit")
 
     def display_calendar(self, year, month):
         """Display a formatted calendar for the specified month"""
@@ -139,59 +145,32 @@ class UserInterface:
     def display_time_slots(self, date):
         """Display available time slots for all courts"""
         print(f"\n{Fore.CYAN}Available Sessions for {date}{Style.RESET_ALL}")
-        
-        # Get all bookings for the date
-        with self.db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT c.court_number, s.start_time, 
-                       COUNT(b.id) as booked_players,
-                       COUNT(w.id) as waiting_list
-                FROM courts c
-                CROSS JOIN (
-                    SELECT DISTINCT start_time 
-                    FROM (
-                        SELECT '07:00' as start_time UNION SELECT '09:00' UNION
-                        SELECT '11:00' UNION SELECT '13:00' UNION
-                        SELECT '15:00' UNION SELECT '17:00' UNION
-                        SELECT '19:00' UNION SELECT '21:00'
-                    )
-                ) times
-                LEFT JOIN sessions s ON s.court_id = c.id 
-                    AND s.date = ? AND s.start_time = times.start_time
-                LEFT JOIN bookings b ON b.session_id = s.id AND b.status = 'booked'
-                LEFT JOIN waiting_list w ON w.session_id = s.id
-                GROUP BY c.court_number, times.start_time
-                ORDER BY times.start_time, c.court_number
-            ''', (date,))
-            bookings = cursor.fetchall()
+
+        grid = self.repository.day_grid(date)
 
         # Prepare the table data
-        headers = ["Time"] + [f"Court {i}" for i in range(1, 7)]
+        headers = ["Time"] + [f"Court {court}" for court in grid.courts]
         table_data = []
-        
-        for time_slot in self.time_slots:
-            row = [time_slot]
-            start_time = time_slot.split('-')[0]
-            
-            for court in range(1, 7):
-                booking = next((b for b in bookings if b[0] == court and b[1] == start_time), None)
-                if booking:
-                    players = booking[2]
-                    waiting = booking[3]
-                    if players >= 6:
-                        status = f"{Fore.RED}Full ({waiting} waiting){Style.RESET_ALL}"
-                    else:
-                        status = f"{Fore.GREEN}{players}/6{Style.RESET_ALL}"
+
+        for i, (start_time, end_time) in enumerate(grid.slots):
+            row = [f"{start_time}-{end_time}"]
+            for j in range(len(grid.courts)):
+                players, waiting = grid.cell(i, j)
+                if not grid.is_available(i, j):
+                    status = f"{Fore.WHITE}Unavailable{Style.RESET_ALL}"
+                elif grid.is_full(i, j):
+                    status = f"{Fore.RED}Full ({waiting} waiting){Style.RESET_ALL}"
                 else:
-                    status = f"{Fore.GREEN}0/6{Style.RESET_ALL}"
+                    status = f"{Fore.GREEN}{players}/{grid.capacity}{Style.RESET_ALL}"
                 row.append(status)
             table_data.append(row)
-        
+
         print(tabulate(table_data, headers=headers, tablefmt="grid"))
         print(f"\n{Fore.YELLOW}Legend:{Style.RESET_ALL}")
-        print(f"{Fore.GREEN}X/6{Style.RESET_ALL} - Available (X players booked)")
+        print(f"{Fore.GREEN}X/{grid.capacity}{Style.RESET_ALL} - Available (X players booked)")
         print(f"{Fore.RED}Full (N waiting){Style.RESET_ALL} - Court full with N players in waiting list")
+        print(f"{Fore.WHITE}Unavailable{Style.RESET_ALL} - No session scheduled yet")
+        return grid
 
     def book_session(self):
         """Handle session booking with calendar and time slot display"""
@@ -213,7 +192,7 @@ class UserInterface:
                 if date < now.date():
                     print("Cannot book sessions in the past")
                     continue
-                if date > now.date() + timedelta(days=7):
+                if date > now.date() + timedelta(days=BOOKING_WINDOW_DAYS):
                     print("Cannot book sessions more than a week in advance")
                     continue
                 break
@@ -221,13 +200,14 @@ class UserInterface:
                 print("Invalid date format. Please use YYYY-MM-DD")
 
         # Show time slots
-        self.display_time_slots(date)
+        grid = self.display_time_slots(date)
         
         # Get booking details
         try:
-            court_id = int(input("\nEnter court number (1-6): "))
-            if not 1 <= court_id <= 6:
+            court_number = int(input(f"\nEnter court number ({grid.courts[0]}-{grid.courts[-1]}): "))
+            if court_number not in grid.courts:
                 raise ValueError("Invalid court number")
+            court_id = self.repository.court_id(court_number)
             
             time_slot = input("Enter time slot (HH:MM): ")
             if not any(time_slot in slot for slot in self.time_slots):
@@ -247,19 +227,104 @@ class UserInterface:
         except Exception as e:
             print(f"An error occurred: {str(e)}")
 
+    def book_series(self):
+        """Book consecutive sessions on several courts, repeated weekly as far as the window allows, all or nothing"""
+        if not self.current_user:
+            print("Please login first")
+            return None
+
+        print("\nBook a Series of Sessions")
+        try:
+            numbers = {self.repository.court_id(int(court)): int(court)
+                       for court in input("Courts (comma separated): ").split(',')}
+            courts = list(numbers)
+            date = datetime.strptime(input("First date (YYYY-MM-DD): ").strip(), '%Y-%m-%d').date()
+            start_time = datetime.strptime(input("Start time (HH:MM): ").strip(), '%H:%M').time()
+            slots = int(input("Consecutive sessions [1]: ").strip() or 1)
+            weeks = 1
+            if MAX_SERIES_WEEKS > 1:
+                weeks = int(input(f"Weeks (up to {MAX_SERIES_WEEKS}) [1]: ").strip() or 1)
+            conflicts = self.booking_system.book_series(self.current_user['id'], courts, date, start_time,
+                                                        slots, weeks)
+        except ValueError as e:
+            print(f"Booking failed: {str(e)}")
+            return None
+
+        # Report conflicts by court number, as the user chose them
+        conflicts = [(numbers[court_id], date, start, reason) for court_id, date, start, reason in conflicts]
+        if conflicts:
+            print("Nothing was booked because of these conflicts:")
+            for court, date, start, reason in conflicts:
+                print(f"Court {court} on {date} at {start}: {reason}")
+        else:
+            print(f"Booked {len(courts) * slots * weeks} sessions")
+        return conflicts
+
+    def find_earliest_slots(self):
+        """Search the booking window for the earliest slots matching the user's filters"""
+        print(f"\nFind Earliest Available Slots (next {BOOKING_WINDOW_DAYS} days)")
+        try:
+            courts = input("Courts (comma separated, blank for any): ").strip()
+            courts = {int(court) for court in courts.split(',')} if courts else None
+            earliest = input("Not starting before (HH:MM, blank for any): ").strip()
+            latest = input("Finishing by (HH:MM, blank for any): ").strip()
+            # Normalise to zero-padded HH:MM so the bounds compare as strings
+            earliest = datetime.strptime(earliest, '%H:%M').strftime('%H:%M') if earliest else None
+            latest = datetime.strptime(latest, '%H:%M').strftime('%H:%M') if latest else None
+            min_free = int(input("Places needed [1]: ").strip() or 1)
+            limit = int(input("How many results [5]: ").strip() or 5)
+            slots = self.repository.find_earliest_slots(courts, earliest, latest, min_free, limit)
+        except ValueError as e:
+            print(f"Search failed: {str(e)}")
+            return None
+
+        if not slots:
+            print("No matching slots in the booking window")
+        for slot in slots:
+            print(f"Court {slot['court']} on {slot['date']}: {slot['start_time']}-{slot['end_time']} "
+                  f"({slot['free']} places free)")
+        return slots
+
+    def respond_to_offers(self):
+        """Confirm or decline places offered from the waiting list"""
+        if not self.current_user:
+            print("Please login first")
+            return
+
+        engine = self.booking_system.waiting_list
+        offers = engine.pending_offers(self.current_user['id'])
+        if not offers:
+            print("You have no open waiting-list offers")
+            return
+
+        for booking_id, court_num, date, start_time, end_time, expires_at in offers:
+            expires = datetime.fromisoformat(expires_at).strftime('%H:%M:%S')
+            print(f"\nCourt {court_num} on {date}: {start_time}-{end_time} (offer expires at {expires})")
+            choice = input("Confirm (c), decline (d) or skip (s)? ").strip().lower()
+            if choice == 'c':
+                if engine.confirm(booking_id, self.current_user['id']):
+                    print("Place confirmed")
+                else:
+                    print("This offer has expired")
+            elif choice == 'd':
+                engine.decline(booking_id, self.current_user['id'])
+                print("Offer declined")
+
     def view_my_bookings(self):
         """View user's bookings"""
         if not self.current_user:
             print("Please login first")
             return
 
-        bookings = self.db.get_player_bookings(self.current_user['id'])
-        if not bookings:
+        # Stream rows so long histories are never held in memory at once
+        bookings = self.repository.player_bookings(self.current_user['id'])
+        first = next(bookings, None)
+        if first is None:
             print("You have no bookings")
             return
 
         print("\nYour Bookings:")
-        for court_num, date, start_time, end_time, status in bookings:
+        for court_num, date, start_time, end_time, status in itertools.chain([first], bookings):
             print(f"Court {court_num} on {date}: {start_time}-{end_time} ({status})")
 
     def view_warnings_and_fines(self):
@@ -268,19 +333,15 @@ class UserInterface:
             print("Please login first")
             return
 
-        with self.db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT warnings, fines 
-                FROM players 
-                WHERE id = ?
-            ''', (self.current_user['id'],))
-            warnings, fines = cursor.fetchone()
-            print(f"\nWarnings: {warnings}/3")
-            print(f"Outstanding Fines: ${fines}")
+        warnings, fines = self.repository.standing(self.current_user['id'])
+        print(f"\nWarnings: {warnings}/3")
+        print(f"Outstanding Fines: ${fines}")
 
     def run(self):
         """Main application loop"""
+        # Make sure the booking window has its sessions even without the background job
+        self.session_generator.run_once()
+        self.repository.schedule.load()
         while True:
             self.display_menu()
             choice = input("Enter your choice: ").strip()
@@ -303,20 +364,29 @@ class UserInterface:
                 elif choice == '3':
                     date_str = input("Enter date (YYYY-MM-DD): ")
                     date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                    sessions = self.db.get_available_sessions(date)
+                    sessions = self.repository.available(date)
                     for session in sessions:
                         print(f"Court {session[1]}: {session[2]}-{session[3]} ({session[4]}/6 players)")
                 elif choice == '4':
                     self.view_warnings_and_fines()
                 elif choice == '5':
+                    self.find_earliest_slots()
+                elif choice == '6':
+                    self.respond_to_offers()
+                elif choice == '7':
+                    self.book_series()
+                elif choice == '8':
                     self.current_user = None
                     print("Logged out successfully")
-                elif choice == '6':
+                elif choice == '9':
                     print("Goodbye!")
                     break
                 else:
                     print("Invalid choice")
 
 if __name__ == "__main__":
+    # Usage: python UserInterface.py [--metrics]  (prints query timings on exit)
+    if '--metrics' in sys.argv:
+        atexit.register(lambda: print(metrics.render()))
     ui = UserInterface()
     ui.run()
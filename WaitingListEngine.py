@@ -0,0 +1,224 @@
+import heapq
+import threading
+from datetime import datetime, timedelta
+from database import Database, SESSION_CAPACITY
+from timecodes import format_minutes, from_day
+from timerwheel import TimerWheel
+
+# How long a promoted player has to confirm a waiting-list offer
+OFFER_MINUTES = 5
+
+
+class WaitingListEngine:
+    """Promotes wait-listed players into free places and expires unconfirmed offers.
+
+    Each session's queue is a heap of (position, entry id, player id) loaded
+    from waiting_list once and then topped up with the rows added since, so a
+    promotion costs O(log n) instead of a sorted scan. An offer is a
+    'pending_confirmation' booking that holds its place until it is confirmed
+    or a timer wheel expires it, at which point the place cascades to the
+    next player in line.
+    """
+
+    def __init__(self, db=None, notification_system=None, clock=datetime.now,
+                 offer_minutes=OFFER_MINUTES, tick=1.0, recover_every=60, name='waiting_list_engine'):
+        self.db = db or Database()
+        self.notification_system = notification_system
+        self.clock = clock
+        self.offer_minutes = offer_minutes
+        self.tick = tick
+        self.recover_every = recover_every
+        self.name = name
+        self.wheel = TimerWheel(tick)
+        self._queues = {}  # session_id -> heap of (position, entry_id, player_id)
+        self._seen = {}  # session_id -> highest waiting_list id pushed onto its heap
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _queue(self, cursor, session_id, waiting_count):
+        """The session's heap, topped up from the database and rebuilt if it has drifted"""
+        heap = self._queues.setdefault(session_id, [])
+        cursor.execute('''
+            SELECT id, player_id, position FROM waiting_list
+            WHERE session_id = ? AND id > ?
+        ''', (session_id, self._seen.get(session_id, 0)))
+        for entry_id, player_id, position in cursor.fetchall():
+            heapq.heappush(heap, (position, entry_id, player_id))
+            self._seen[session_id] = max(self._seen.get(session_id, 0), entry_id)
+
+        if len(heap) != waiting_count:
+            # Rows were removed behind our back (another process, a rollback); reload
+            cursor.execute('''
+                SELECT position, id, player_id FROM waiting_list WHERE session_id = ?
+            ''', (session_id,))
+            heap[:] = cursor.fetchall()
+            heapq.heapify(heap)
+            self._seen[session_id] = max((entry[1] for entry in heap), default=0)
+        return heap
+
+    def promote(self, session_ids, now=None):
+        """Offer every free place in the given sessions to the front of their queues.
+
+        Returns the (player_id, session_id) pairs that received an offer.
+        """
+        session_ids = list(set(session_ids))
+        if not session_ids:
+            return []
+        now = now or self.clock()
+        expires_at = now + timedelta(minutes=self.offer_minutes)
+
+        # Always take the database write lock before the engine lock, as decline() does
+        with self.db.transaction() as conn, self._lock:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT id, waiting_count, booked_count + (
+                    SELECT COUNT(*) FROM bookings
+                    WHERE session_id = sessions.id AND status = 'pending_confirmation'
+                )
+                FROM sessions
+                WHERE id IN ({','.join('?' * len(session_ids))}) AND waiting_count > 0
+            ''', session_ids)
+
+            offers = []
+            try:
+                for session_id, waiting_count, held in cursor.fetchall():
+                    heap = self._queue(cursor, session_id, waiting_count)
+                    free = SESSION_CAPACITY - held
+                    while free > 0 and heap:
+                        candidates = [heapq.heappop(heap) for _ in range(min(free, len(heap)))]
+                        cursor.execute(f'''
+                            DELETE FROM waiting_list
+                            WHERE id IN ({','.join('?' * len(candidates))})
+                            RETURNING id
+                        ''', [entry_id for _, entry_id, _ in candidates])
+                        removed = {row[0] for row in cursor.fetchall()}
+                        for _, entry_id, player_id in candidates:
+                            if entry_id in removed:
+                                offers.append((player_id, session_id))
+                        free -= len(removed)
+
+                for player_id, session_id in offers:
+                    cursor.execute('''
+                        INSERT INTO bookings (player_id, session_id, status, offer_expires_at)
+                        VALUES (?, ?, 'pending_confirmation', ?)
+                    ''', (player_id, session_id, expires_at.isoformat()))
+                    self.wheel.schedule(cursor.lastrowid, expires_at)
+            except BaseException:
+                # Popped entries may be rolled back; rebuild these queues from the database
+                for session_id in session_ids:
+                    self._queues.pop(session_id, None)
+                    self._seen.pop(session_id, None)
+                raise
+        return offers
+
+    def pending_offers(self, player_id, now=None):
+        """(booking_id, court, date, start_time, end_time, expires_at) for a player's live offers"""
+        now = now or self.clock()
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT b.id, c.court_number, s.day, s.start_minute, s.end_minute, b.offer_expires_at
+                FROM bookings b
+                JOIN sessions s ON b.session_id = s.id
+                JOIN courts c ON s.court_id = c.id
+                WHERE b.player_id = ? AND b.status = 'pending_confirmation' AND b.offer_expires_at > ?
+                ORDER BY b.offer_expires_at
+            ''', (player_id, now.isoformat()))
+            return [(booking_id, court, str(from_day(day)), format_minutes(start), format_minutes(end), expires_at)
+                    for booking_id, court, day, start, end, expires_at in cursor.fetchall()]
+
+    def confirm(self, booking_id, player_id, now=None):
+        """Turn a live offer into a booking; False if it is not the player's or has expired"""
+        now = now or self.clock()
+        with self.db.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE bookings SET status = 'booked', offer_expires_at = NULL
+                WHERE id = ? AND player_id = ? AND status = 'pending_confirmation'
+                  AND offer_expires_at > ?
+            ''', (booking_id, player_id, now.isoformat()))
+            confirmed = cursor.rowcount == 1
+        if confirmed:
+            self.wheel.cancel(booking_id)
+        return confirmed
+
+    def decline(self, booking_id, player_id, now=None):
+        """Give up a live offer and pass the place on; returns the offers that cascaded"""
+        now = now or self.clock()
+        with self.db.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE bookings SET status = 'offer_declined'
+                WHERE id = ? AND player_id = ? AND status = 'pending_confirmation'
+                RETURNING session_id
+            ''', (booking_id, player_id))
+            row = cursor.fetchone()
+            if row is None:
+                return []
+            self.wheel.cancel(booking_id)
+            return self.promote([row[0]], now)
+
+    def recover(self):
+        """Put every outstanding offer in the database on the timer wheel"""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, offer_expires_at FROM bookings
+                WHERE status = 'pending_confirmation' AND offer_expires_at IS NOT NULL
+            ''')
+            rows = cursor.fetchall()
+        for booking_id, expires_at in rows:
+            self.wheel.schedule(booking_id, datetime.fromisoformat(expires_at))
+        return len(rows)
+
+    def expire_due(self, now=None):
+        """Expire offers whose window has passed and cascade their places down the queue"""
+        now = now or self.clock()
+        due = self.wheel.advance(now)
+        if not due:
+            return []
+
+        with self.db.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                UPDATE bookings SET status = 'offer_expired'
+                WHERE id IN ({','.join('?' * len(due))})
+                  AND status = 'pending_confirmation' AND offer_expires_at <= ?
+                RETURNING session_id
+            ''', due + [now.isoformat()])
+            return self.promote([row[0] for row in cursor.fetchall()], now)
+
+    def run_once(self, now=None):
+        promoted = self.expire_due(now)
+        if promoted and self.notification_system:
+            self.notification_system.notify_sweep({'late': [], 'no_show': [], 'promoted': promoted})
+        return promoted
+
+    def run_forever(self):
+        """Tick every `tick` seconds until stop() is called"""
+        ticks = 0
+        while not self._stop.is_set():
+            try:
+                # Also pick up offers made by other processes now and again
+                if ticks % self.recover_every == 0:
+                    self.recover()
+                self.run_once()
+            except Exception as e:
+                print(f"Waiting-list tick failed: {str(e)}")
+            ticks += 1
+            self._stop.wait(self.tick)
+
+    def start(self):
+        """Run the engine's timer on a daemon thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run_forever, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
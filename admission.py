@@ -0,0 +1,212 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from datetime import datetime, timedelta
+from metrics import metrics
+from schedule import BOOKING_WINDOW_DAYS
+from timecodes import to_day, to_minutes
+
+# Seconds after a slot becomes bookable during which requests go into a lottery (0 turns it off)
+LOTTERY_SECONDS = float(os.environ.get('LOTTERY_SECONDS', 0))
+
+# Longest a caller waits for its booking before giving up
+ADMISSION_TIMEOUT = 30
+
+# Requests for one slot committed per transaction
+MAX_BATCH = 500
+
+
+class BookingRequest:
+    __slots__ = ('player_id', 'court_id', 'date', 'start_time', 'future', 'queued_at')
+
+    def __init__(self, player_id, court_id, date, start_time):
+        self.player_id = player_id
+        self.court_id = court_id
+        self.date = date
+        self.start_time = start_time
+        self.future = Future()
+        self.queued_at = time.monotonic()
+
+
+class AdmissionQueue:
+    """Booking requests queued per (court, day, slot) and written by one thread.
+
+    Concurrent requesters no longer race for the SQLite write lock: a single
+    writer takes each slot's queued requests in turn and books them
+    serially inside one transaction, so a burst of N requests costs one
+    commit per slot instead of N contended ones. A failing request is rolled
+    back to its own savepoint and does not affect the rest of the batch.
+
+    With `lottery_seconds`, requests that arrive within that long of a slot
+    opening (BOOKING_WINDOW_DAYS before it starts) are held until the window
+    closes and then booked in a random order, so being a few milliseconds
+    faster does not decide who plays.
+    """
+
+    def __init__(self, repository, lottery_seconds=LOTTERY_SECONDS, max_batch=MAX_BATCH,
+                 clock=datetime.now, seed=None, name='admission_queue'):
+        self.repository = repository
+        self.lottery_seconds = lottery_seconds
+        self.max_batch = max_batch
+        self.clock = clock
+        self.name = name
+        self._rng = random.Random(seed)
+        self._groups = {}  # (court_id, day, start_minute) -> list of BookingRequests
+        self._held = {}  # group key -> monotonic time its lottery is drawn
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {'submitted': 0, 'processed': 0, 'failed': 0, 'cancelled': 0, 'batches': 0,
+                      'lotteries': 0, 'depth': 0, 'max_depth': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0}
+
+    def _lottery_draw(self, date, start_time):
+        """Monotonic time to draw the slot's lottery at, or None if it has been open long enough"""
+        if not self.lottery_seconds:
+            return None
+        opens_at = datetime.combine(date, start_time) - timedelta(days=BOOKING_WINDOW_DAYS)
+        remaining = (opens_at + timedelta(seconds=self.lottery_seconds) - self.clock()).total_seconds()
+        if remaining <= 0 or remaining > self.lottery_seconds:
+            return None
+        return time.monotonic() + remaining
+
+    def submit(self, player_id, court_id, date, start_time):
+        """Queue a booking and return a Future for book_slot()'s result"""
+        self.start()
+        request = BookingRequest(player_id, court_id, date, start_time)
+        key = (court_id, to_day(date), to_minutes(start_time))
+        with self._condition:
+            group = self._groups.setdefault(key, [])
+            if not group and key not in self._held:
+                draw_at = self._lottery_draw(date, start_time)
+                if draw_at is not None:
+                    self._held[key] = draw_at
+            group.append(request)
+            self.stats['submitted'] += 1
+            self.stats['depth'] += 1
+            self.stats['max_depth'] = max(self.stats['max_depth'], self.stats['depth'])
+            self._condition.notify()
+        metrics.add_gauge('admission_queue_depth', 1)
+        return request.future
+
+    def book(self, player_id, court_id, date, start_time, timeout=ADMISSION_TIMEOUT):
+        """Book through the queue and wait for the outcome; raises ValueError like book_slot()"""
+        future = self.submit(player_id, court_id, date, start_time)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            if not future.cancel():
+                # The writer has already taken it, so its outcome is moments away
+                return future.result()
+            raise ValueError("Booking is taking too long, please try again")
+
+    def _take(self):
+        """Wait for slots with requests that are due, and remove them from the queue"""
+        with self._condition:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                ready, next_draw = [], None
+                for key, group in self._groups.items():
+                    draw_at = self._held.get(key)
+                    if draw_at is None or draw_at <= now:
+                        ready.append(key)
+                    else:
+                        next_draw = draw_at if next_draw is None else min(next_draw, draw_at)
+                if ready:
+                    batches = []
+                    for key in ready:
+                        group = self._groups[key]
+                        lottery = self._held.pop(key, None) is not None
+                        if lottery:
+                            # Everyone in the opening window has the same chance, whatever their arrival order
+                            self._rng.shuffle(group)
+                            self.stats['lotteries'] += 1
+                        batches.append(group[:self.max_batch])
+                        if len(group) > self.max_batch:
+                            self._groups[key] = group[self.max_batch:]
+                        else:
+                            del self._groups[key]
+                    return batches
+                self._condition.wait(None if next_draw is None else next_draw - now)
+        return []
+
+    def _process(self, requests):
+        """Book one slot's requests in order inside a single transaction"""
+        started = time.monotonic()
+        taken = len(requests)
+        # Callers that timed out cancelled their futures; drop those requests instead of booking them
+        requests = [request for request in requests if request.future.set_running_or_notify_cancel()]
+        outcomes = []
+        if requests:
+            try:
+                with self.repository.unit_of_work() as uow:
+                    cursor = uow.conn.cursor()
+                    for request in requests:
+                        cursor.execute('SAVEPOINT admission')
+                        try:
+                            outcomes.append((True, uow.book(request.player_id, request.court_id,
+                                                            request.date, request.start_time)))
+                        except (ValueError, sqlite3.IntegrityError) as e:
+                            cursor.execute('ROLLBACK TO admission')
+                            outcomes.append((False, ValueError(str(e))))
+                        cursor.execute('RELEASE admission')
+            except Exception as e:
+                outcomes = [(False, e)] * len(requests)
+
+        waits = [started - request.queued_at for request in requests]
+        with self._condition:
+            self.stats['processed'] += len(requests)
+            self.stats['failed'] += sum(not ok for ok, _ in outcomes)
+            self.stats['cancelled'] += taken - len(requests)
+            self.stats['batches'] += bool(requests)
+            self.stats['depth'] -= taken
+            self.stats['wait_seconds'] += sum(waits)
+            self.stats['max_wait_seconds'] = max([self.stats['max_wait_seconds']] + waits)
+        metrics.add_gauge('admission_queue_depth', -taken)
+        for wait in waits:
+            metrics.observe_queue_wait(self.name, wait)
+
+        # Answer callers only once the batch has committed
+        for request, (ok, outcome) in zip(requests, outcomes):
+            if ok:
+                request.future.set_result(outcome)
+            else:
+                request.future.set_exception(outcome)
+
+    def report(self):
+        """Queue depth, batching and mean/max wait so far"""
+        with self._condition:
+            stats = dict(self.stats)
+        stats['mean_wait_ms'] = stats['wait_seconds'] * 1000 / max(stats['processed'], 1)
+        stats['max_wait_ms'] = stats.pop('max_wait_seconds') * 1000
+        stats['mean_batch'] = stats['processed'] / max(stats['batches'], 1)
+        del stats['wait_seconds']
+        return stats
+
+    def run_forever(self):
+        """Book queued requests until stop() is called"""
+        while not self._stop.is_set():
+            for requests in self._take():
+                try:
+                    self._process(requests)
+                except Exception as e:
+                    print(f"Admission batch failed: {str(e)}")
+
+    def start(self):
+        """Start the writer thread if it is not running yet"""
+        with self._condition:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        with self._condition:
+            self._stop.set()
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
@@ -1,51 +1,62 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
-from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
+from flask import Flask
+from flask_login import LoginManager, UserMixin
+from database import Database
+from repository import Repository
+from SessionGenerator import SessionGenerator
 import os
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key'  # Change this to a secure secret key
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///gym_booking.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['DATABASE_URL'] = os.environ.get('DATABASE_URL', 'sqlite:///gym_booking.db')
 
-db = SQLAlchemy(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
-# User model
-class User(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128))
-    bookings = db.relationship('Booking', backref='user', lazy=True)
-
-    def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
-
-    def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
-
-# Booking model
-class Booking(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    court_number = db.Column(db.Integer, nullable=False)
-    date = db.Column(db.Date, nullable=False)
-    start_time = db.Column(db.Time, nullable=False)
-    end_time = db.Column(db.Time, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+def database_file(url):
+    """Path of the SQLite file named by a sqlite:/// URL, relative to the working directory like the CLI's"""
+    if not url.startswith('sqlite:///'):
+        raise ValueError("DATABASE_URL must be a sqlite:/// URL")
+    return url[len('sqlite:///'):]
+
+# The same players/sessions/bookings data and caches as the CLI, opened by create_app()
+repository = None
+
+class User(UserMixin):
+    """Flask-Login's view of a players row"""
+
+    def __init__(self, id, name, email, password_hash, username=None):
+        self.id = id
+        self.username = username or name
+        self.email = email
+        self.password_hash = password_hash
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Authenticated requests are served from the repository's account cache
+    account = repository.account(int(user_id))
+    return User(*account) if account else None
+
+def create_app():
+    """Open the database, start the background jobs and register the routes, once per process.
+
+    Nothing here runs at import time: password hashing workers re-import the
+    main script, and must not open the database or start threads of their own.
+    """
+    global repository
+    if repository is None:
+        repository = Repository.for_database(Database(database_file(app.config['DATABASE_URL'])))
+
+        # Bookings only look sessions up, so the booking window must have them before the first request
+        session_generator = SessionGenerator(repository.db)
+        session_generator.run_once()
+        session_generator.start()
 
-# Routes will be imported from routes.py
-from routes import *
+        # Routes will be imported from routes.py
+        import routes
+    return app
 
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
-    app.run(debug=True)
+    # Go through the importable module, which routes.py shares, rather than this __main__ copy
+    from app import create_app
+    create_app().run(debug=True, port=int(os.environ.get('PORT', 5000)))
@@ -0,0 +1,797 @@
+import contextlib
+import io
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from database import ConnectionPool, Database, MIGRATIONS, SESSION_CAPACITY
+
+
+def _timed(func, repeat):
+    """Return the mean wall time of func() in milliseconds"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def _fresh_process_database(db_file):
+    """Construct a Database as a newly started process would"""
+    ConnectionPool._pools.clear()
+    Database(db_file)
+
+
+def _legacy_init(db_file):
+    """Old behaviour: reconnect and re-run every DDL statement"""
+    import sqlite3
+    with sqlite3.connect(db_file) as conn:
+        MIGRATIONS[0][1](conn.cursor())
+
+
+def benchmark_startup(repeat=200):
+    """Time Database() start-up for cold, warm and legacy paths"""
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+
+        def cold():
+            path = os.path.join(tmp, f"cold_{time.perf_counter_ns()}.db")
+            _fresh_process_database(path)
+
+        results['cold_new_file_ms'] = _timed(cold, 20)
+
+        db_file = os.path.join(tmp, "warm.db")
+        Database(db_file)
+        results['legacy_ddl_per_instance_ms'] = _timed(lambda: _legacy_init(db_file), repeat)
+        results['new_process_current_schema_ms'] = _timed(lambda: _fresh_process_database(db_file), repeat)
+        results['same_process_instance_ms'] = _timed(lambda: Database(db_file), repeat)
+
+        # Full interpreter launch, as paid by every CLI invocation or worker
+        code = f"from database import Database; Database({db_file!r})"
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        results['cli_launch_ms'] = _timed(
+            lambda: subprocess.run([sys.executable, "-c", code], cwd=cwd, check=True), 5
+        )
+        ConnectionPool._pools.clear()
+        return results
+
+
+def stress_booking(threads=16, bookings_per_thread=100, sessions=4, seed=0):
+    """Hammer a handful of sessions from many threads and check nothing is overbooked"""
+    from BookingSystem import BookingSystem
+    from SessionGenerator import SessionGenerator
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "stress.db"))
+        SessionGenerator(db).run_once()
+        booking_system = BookingSystem(db)
+        player_ids = [db.add_player(f"Player {i}", f"p{i}@example.com", "secret1")
+                      for i in range(threads * bookings_per_thread)]
+        date = (datetime.now() + timedelta(days=1)).date()
+        start_time = datetime.strptime('09:00', '%H:%M').time()
+        slots = [(court, start_time) for court in range(1, sessions + 1)]
+        errors = []
+
+        def worker(index):
+            rng = random.Random(seed + index)
+            mine = player_ids[index * bookings_per_thread:(index + 1) * bookings_per_thread]
+            try:
+                for player_id in mine:
+                    court, slot_start = rng.choice(slots)
+                    booking_system.book_session(player_id, court, date, slot_start)
+            except Exception as e:
+                errors.append(e)
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        start = time.perf_counter()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT s.id, s.booked_count,
+                       (SELECT COUNT(*) FROM bookings WHERE session_id = s.id AND status IN ('booked', 'late')),
+                       (SELECT COUNT(*) FROM waiting_list WHERE session_id = s.id),
+                       (SELECT COUNT(DISTINCT position) FROM waiting_list WHERE session_id = s.id),
+                       (SELECT MAX(position) FROM waiting_list WHERE session_id = s.id)
+                FROM sessions s
+            ''')
+            for session_id, counter, booked, waiting, distinct, max_position in cursor.fetchall():
+                assert booked <= SESSION_CAPACITY, f"session {session_id} overbooked: {booked}"
+                assert counter == booked, f"session {session_id} counter {counter} != {booked}"
+                assert waiting == distinct == (max_position or 0), \
+                    f"session {session_id} has duplicate or missing waiting-list positions"
+        db.close()
+
+        if errors:
+            raise errors[0]
+        total = threads * bookings_per_thread
+        return {'bookings': total, 'seconds': elapsed, 'bookings_per_second': total / elapsed}
+
+
+class _LoopbackSMTP:
+    """SMTP stand-in that accepts every message after a fixed round-trip delay"""
+    connections = 0
+
+    def __init__(self, host, port, latency=0.002):
+        type(self).connections += 1
+        self.latency = latency
+
+    def send_message(self, msg):
+        time.sleep(self.latency)
+
+    def quit(self):
+        pass
+
+
+def benchmark_outbox(messages=1000, workers=4):
+    """Drain a queued burst through the outbox worker pool"""
+    from EmailOutbox import EmailOutbox
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "outbox.db"))
+        config = {'smtp_server': 'localhost', 'smtp_port': 1025, 'sender': 'gym@example.com'}
+        _LoopbackSMTP.connections = 0
+        outbox = EmailOutbox(config, db, workers=workers, poll_interval=0.01, smtp_factory=_LoopbackSMTP)
+        outbox.enqueue_many([(f"p{i}@example.com", "Subject", "Body") for i in range(messages)])
+
+        start = time.perf_counter()
+        outbox.start()
+        while outbox.stats['sent'] + outbox.stats['failed'] < messages:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        outbox.stop()
+        db.close()
+        return {'emails': messages, 'smtp_connections': _LoopbackSMTP.connections,
+                'emails_per_second': messages / elapsed}
+
+
+def benchmark_login(pool_sizes=(1, 2, 4), logins=64, concurrency=16, method='pbkdf2:sha256:100000'):
+    """Login verifications per second for each hashing pool size"""
+    from concurrent.futures import ThreadPoolExecutor
+    from hashing import PasswordHasher
+
+    results = {}
+    for workers in pool_sizes:
+        hasher = PasswordHasher(method=method, workers=workers)
+        stored = hasher.hash("secret1")  # Also warms up the pool
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as requests:
+            assert all(ok for ok, _ in requests.map(lambda _: hasher.verify(stored, "secret1"), range(logins)))
+        results[f'logins_per_second_pool_{workers}'] = logins / (time.perf_counter() - start)
+        hasher.shutdown()
+    return results
+
+
+def _search_by_day(db, courts, earliest, latest, min_free, limit, now):
+    """Old approach: one availability query per date, scanned in order"""
+    from schedule import BOOKING_WINDOW_DAYS, build_day_grid
+
+    horizon = now + timedelta(days=BOOKING_WINDOW_DAYS)
+    results = []
+    for offset in range(BOOKING_WINDOW_DAYS + 1):
+        grid = build_day_grid(db, now.date() + timedelta(days=offset))
+        for i, (start, end) in enumerate(grid.slots):
+            starts_at = datetime.strptime(f"{grid.date} {start}", '%Y-%m-%d %H:%M')
+            if (starts_at < now or starts_at > horizon or (earliest and start < earliest)
+                    or (latest and end > latest)):
+                continue
+            for j, court in enumerate(grid.courts):
+                if (courts is None or court in courts) and grid.is_available(i, j) and grid.free(i, j) >= min_free:
+                    results.append({'date': str(grid.date), 'court': court, 'start_time': start,
+                                    'end_time': end, 'free': grid.free(i, j)})
+                    if len(results) >= limit:
+                        return results
+    return results
+
+
+def benchmark_search(courts=200, fill=0.9, searches=200, seed=0):
+    """Time earliest-slot searches over a busy week and check them against a per-day scan"""
+    from schedule import BOOKING_WINDOW_DAYS, WeekOccupancy, time_slots
+    from timecodes import to_day, to_minutes
+
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "search.db"))
+        now = datetime.now().replace(second=0, microsecond=0)
+        with db.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('INSERT OR IGNORE INTO courts (court_number) VALUES (?)',
+                               [(n,) for n in range(1, courts + 1)])
+            cursor.execute('SELECT id FROM courts')
+            court_ids = [row[0] for row in cursor.fetchall()]
+            # Mostly full sessions so matches sit deep in the week
+            cursor.executemany('''
+                INSERT INTO sessions (court_id, day, start_minute, end_minute, booked_count)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [
+                (court_id, to_day(now) + day, to_minutes(start), to_minutes(end),
+                 SESSION_CAPACITY if rng.random() < fill else rng.randint(0, SESSION_CAPACITY))
+                for court_id in court_ids
+                for day in range(BOOKING_WINDOW_DAYS + 1)
+                for start, end in time_slots()
+            ])
+
+        queries = []
+        for _ in range(searches):
+            lo = rng.choice([None, '09:00', '13:00'])
+            hi = rng.choice([None, '17:00', '23:00'])
+            chosen = None if rng.random() < 0.5 else set(rng.sample(range(1, courts + 1), 5))
+            queries.append((chosen, lo, hi, rng.randint(1, 4), rng.choice([1, 5, 20])))
+
+        week = WeekOccupancy(db)
+        for query in queries[:20]:
+            expected = _search_by_day(db, *query, now)
+            assert week.find_earliest_slots(*query, now=now) == expected, f"search mismatch for {query}"
+
+        # A booking must invalidate the cached week
+        first = week.find_earliest_slots(min_free=SESSION_CAPACITY, now=now)[0]
+        player_id = db.add_player("Searcher", "searcher@example.com", "secret1")
+        cursor = db.get_connection().execute('SELECT id FROM courts WHERE court_number = ?', (first['court'],))
+        db.book_slot(player_id, cursor.fetchone()[0], first['date'], first['start_time'])
+        assert week.find_earliest_slots(min_free=SESSION_CAPACITY, now=now)[0] != first, "stale week occupancy"
+
+        results = {
+            'search_cold_ms': _timed(lambda: WeekOccupancy(db).find_earliest_slots(now=now), 5),
+            'search_ms': _timed(lambda: [week.find_earliest_slots(*q, now=now) for q in queries], 1) / searches,
+            'search_by_day_ms': _timed(lambda: [_search_by_day(db, *q, now) for q in queries], 1) / searches,
+        }
+        db.close()
+        return results
+
+
+def benchmark_session_generation(courts=200):
+    """Time filling and extending the booking window for many courts"""
+    from SessionGenerator import SessionGenerator
+    from schedule import time_slots
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "generate.db"))
+        with db.transaction() as conn:
+            conn.executemany('INSERT OR IGNORE INTO courts (court_number) VALUES (?)',
+                             [(n,) for n in range(1, courts + 1)])
+        day = datetime.now()
+        generator = SessionGenerator(db, clock=lambda: day)
+
+        start = time.perf_counter()
+        created = generator.run_once()
+        results = {'generate_window_ms': (time.perf_counter() - start) * 1000,
+                   'sessions_created': created}
+
+        # The next day only the newly exposed date is generated
+        day += timedelta(days=1)
+        start = time.perf_counter()
+        extended = generator.run_once()
+        results['extend_one_day_ms'] = (time.perf_counter() - start) * 1000
+        assert extended == courts * len(time_slots()), f"extended by {extended} sessions"
+        results['refill_window_ms'] = _timed(lambda: generator.run_once(full=True), 3)
+        db.close()
+        return results
+
+
+def stress_waiting_list(sessions=20, waiting_per_session=250, threads=8, seed=0):
+    """Cascade offers through thousands of wait-listed players from many threads"""
+    from SessionGenerator import SessionGenerator
+    from WaitingListEngine import WaitingListEngine
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "waiting.db"))
+        clock = [datetime.now()]
+        engine = WaitingListEngine(db, clock=lambda: clock[0])
+        SessionGenerator(db).run_once()
+        with db.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id FROM sessions ORDER BY id LIMIT ?', (sessions,))
+            session_ids = [row[0] for row in cursor.fetchall()]
+        per_session = SESSION_CAPACITY + waiting_per_session
+        players = [db.add_player(f"Player {i}", f"w{i}@example.com", "secret1")
+                   for i in range(sessions * per_session)]
+        expected = {}  # session_id -> wait-listed players in queue order
+        for index, session_id in enumerate(session_ids):
+            mine = players[index * per_session:(index + 1) * per_session]
+            for player_id in mine:
+                db.create_booking(player_id, session_id)
+            expected[session_id] = mine[SESSION_CAPACITY:]
+
+        # Everyone booked cancels at once, so every session promotes a full batch
+        with db.transaction() as conn:
+            conn.execute("UPDATE bookings SET status = 'cancelled' WHERE status = 'booked'")
+        start = time.perf_counter()
+        engine.promote(session_ids)
+
+        errors = []
+        done = threading.Event()
+
+        def responder(index):
+            rng = random.Random(seed + index)
+            try:
+                while not done.is_set():
+                    with db.get_connection() as conn:
+                        offers = conn.execute('''
+                            SELECT id, player_id FROM bookings WHERE status = 'pending_confirmation'
+                        ''').fetchall()
+                    for booking_id, player_id in rng.sample(offers, min(len(offers), 10)):
+                        choice = rng.random()
+                        if choice < 0.2:
+                            engine.confirm(booking_id, player_id)
+                        elif choice < 0.6:
+                            engine.decline(booking_id, player_id)
+            except Exception as e:
+                errors.append(e)
+
+        workers = [threading.Thread(target=responder, args=(i,)) for i in range(threads)]
+        for t in workers:
+            t.start()
+        # Let unanswered offers lapse on the timer wheel until no offer is outstanding
+        while True:
+            clock[0] += timedelta(minutes=engine.offer_minutes, seconds=1)
+            engine.expire_due()
+            with db.get_connection() as conn:
+                if not conn.execute("SELECT COUNT(*) FROM bookings WHERE status = 'pending_confirmation'").fetchone()[0]:
+                    break
+        done.set()
+        for t in workers:
+            t.join()
+        elapsed = time.perf_counter() - start
+        assert not errors, errors
+
+        offered = 0
+        with db.get_connection() as conn:
+            for session_id in session_ids:
+                rows = conn.execute('''
+                    SELECT player_id, status FROM bookings
+                    WHERE session_id = ? AND status != 'cancelled' ORDER BY id
+                ''', (session_id,)).fetchall()
+                waiting = [row[0] for row in conn.execute(
+                    'SELECT player_id FROM waiting_list WHERE session_id = ? ORDER BY position', (session_id,))]
+                booked = sum(1 for _, status in rows if status == 'booked')
+                assert booked <= SESSION_CAPACITY, f"session {session_id} overbooked"
+                # Offers went out strictly in queue order and the rest are still waiting
+                assert [row[0] for row in rows] + waiting == expected[session_id], \
+                    f"session {session_id} promoted out of order"
+                offered += len(rows)
+        assert not db.check_occupancy_counters(), "occupancy counters drifted"
+        db.close()
+        return {'waitlisted': sessions * waiting_per_session, 'offers': offered,
+                'seconds': elapsed, 'offers_per_second': offered / elapsed}
+
+
+def benchmark_schedule_model(players=2000, weeks=1, reads=2000, seed=0):
+    """Memory per 1000 bookings and read latency of ScheduleModel against SQL, plus a cross-process reload"""
+    import gc
+    import tracemalloc
+    from repository import ScheduleModel
+    from workload import generate_workload
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "model.db")
+        db = Database(db_file)
+        generate_workload(db, players=players, past_weeks=0, weeks=weeks, seed=seed)
+        model = ScheduleModel(db)
+
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        model.load()
+        results = {'load_ms': (time.perf_counter() - start) * 1000}
+        gc.collect()
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        bookings = sum(len(session.bookings) for session in model.sessions.values())
+        results['bookings_loaded'] = bookings
+        results['bytes_per_1000_bookings'] = held * 1000 / max(bookings, 1)
+
+        rng = random.Random(seed)
+        days = sorted({session.date for session in model.sessions.values()})
+        session_ids = list(model.sessions)
+        results['available_model_ms'] = _timed(lambda: model.available(rng.choice(days)), reads)
+        results['available_sql_ms'] = _timed(lambda: db.get_available_sessions(rng.choice(days)), reads)
+        results['roster_model_ms'] = _timed(lambda: model.roster(rng.choice(session_ids)), reads)
+        with db.get_connection() as conn:
+            results['roster_sql_ms'] = _timed(lambda: conn.execute(
+                'SELECT id, player_id, status FROM bookings WHERE session_id = ?',
+                (rng.choice(session_ids),)).fetchall(), reads)
+
+        # Another process cancels a booking; the next read must notice and reload
+        session_id = next(s for s, session in model.sessions.items() if session.bookings)
+        booking_id = model.roster(session_id)[0].booking_id
+        code = ("import sqlite3; conn = sqlite3.connect(%r); "
+                "conn.execute('DELETE FROM bookings WHERE id = ?', (%d,)); conn.commit()") % (db_file, booking_id)
+        subprocess.run([sys.executable, "-c", code], check=True)
+        start = time.perf_counter()
+        roster = model.roster(session_id)
+        results['reload_after_external_write_ms'] = (time.perf_counter() - start) * 1000
+        assert booking_id not in [booking.booking_id for booking in roster], "model missed an external write"
+        db.close()
+        return results
+
+def benchmark_change_feed(clients=200, bookings=100, players=50, seed=0):
+    """Delivery latency from commit to `clients` concurrent followers sharing one poller"""
+    from repository import Repository
+    from schedule import time_slots
+    from SessionGenerator import SessionGenerator
+    from timecodes import format_minutes, to_minutes
+
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "feed.db"))
+        SessionGenerator(db).run_once()
+        player_ids = [db.add_player(f"Player {i}", f"player{i}@example.com", "secret1") for i in range(players)]
+        repository = Repository(db)
+        feed = repository.events
+        feed.start()
+        day = (datetime.now() + timedelta(days=1)).date()
+        starts = [datetime.strptime(start, '%H:%M').time() for start, _ in time_slots()]
+
+        written = {}  # (court, 'HH:MM') -> when its latest booking started
+        latencies, lock = [], threading.Lock()
+        done = threading.Event()
+
+        def follow():
+            for kind, _, delta in feed.follow(heartbeat=0.5, date=day.isoformat()):
+                if kind == 'delta':
+                    sent = written.get((delta['court'], delta['start']))
+                    if sent is not None:
+                        with lock:
+                            latencies.append(time.perf_counter() - sent)
+                if done.is_set():
+                    return
+
+        followers = [threading.Thread(target=follow, daemon=True) for _ in range(clients)]
+        for thread in followers:
+            thread.start()
+        time.sleep(0.2)
+
+        held = set()  # (player, court, slot) already booked or waiting, which a second booking is refused for
+        start = time.perf_counter()
+        for _ in range(bookings):
+            court, slot = rng.randint(1, 6), rng.choice(starts)
+            player_id = rng.choice([player_id for player_id in player_ids if (player_id, court, slot) not in held])
+            held.add((player_id, court, slot))
+            written[(court, format_minutes(to_minutes(slot)))] = time.perf_counter()
+            with repository.unit_of_work() as uow:
+                uow.book(player_id, court, day, slot)
+            time.sleep(0.005)
+        writes = time.perf_counter() - start
+        time.sleep(1.0)
+        done.set()
+        for thread in followers:
+            thread.join(2)
+        feed.stop()
+        db.close()
+
+    latencies.sort()
+    return {
+        'clients': clients,
+        'bookings_per_s': bookings / writes,
+        'deliveries': len(latencies),
+        'delivery_mean_ms': sum(latencies) / max(len(latencies), 1) * 1000,
+        'delivery_p95_ms': latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0.0,
+    }
+
+
+def stress_admission(requests=5000, threads=64, slots=12, lottery_seconds=0.2, seed=0):
+    """A burst of bookings for a few freshly opened slots: direct transactions against the admission queue"""
+    from admission import AdmissionQueue
+    from repository import Repository
+    from schedule import BOOKING_WINDOW_DAYS, time_slots
+    from SessionGenerator import SessionGenerator
+
+    day = (datetime.now() + timedelta(days=1)).date()
+    starts = [datetime.strptime(start, '%H:%M').time() for start, _ in time_slots()]
+    targets = [(court, start) for start in starts for court in range(1, 7)][:slots]
+    opens_at = datetime.combine(day, targets[0][1]) - timedelta(days=BOOKING_WINDOW_DAYS)
+
+    def burst(mode):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Database(os.path.join(tmp, f"{mode}.db"))
+            SessionGenerator(db).run_once()
+            with db.transaction() as conn:
+                conn.executemany('INSERT INTO players (name, email, password) VALUES (?, ?, ?)',
+                                 [(f"Player {i}", f"p{i}@example.com", "secret1") for i in range(requests)])
+            repository = Repository(db)
+            if mode == 'lottery':
+                # Every slot counts as just opened, so each group waits for its draw
+                repository.admission = AdmissionQueue(repository, lottery_seconds=lottery_seconds,
+                                                      clock=lambda: opens_at, seed=seed)
+            latencies, errors, lock = [], [], threading.Lock()
+
+            def worker(index):
+                rng = random.Random(seed + index)
+                for player_id in range(index + 1, requests + 1, threads):
+                    court, start_time = rng.choice(targets)
+                    began = time.perf_counter()
+                    try:
+                        if mode == 'direct':
+                            with repository.unit_of_work() as uow:
+                                uow.book(player_id, court, day, start_time)
+                        else:
+                            repository.admission.book(player_id, court, day, start_time)
+                    except Exception as e:
+                        errors.append(e)
+                    with lock:
+                        latencies.append(time.perf_counter() - began)
+
+            workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+            start = time.perf_counter()
+            for t in workers:
+                t.start()
+            for t in workers:
+                t.join()
+            elapsed = time.perf_counter() - start
+            report = repository.admission.report()
+            repository.admission.stop()
+
+            with db.get_connection() as conn:
+                booked, waiting, overbooked = conn.execute(f'''
+                    SELECT SUM(booked_count), SUM(waiting_count), SUM(booked_count > {SESSION_CAPACITY})
+                    FROM sessions
+                ''').fetchone()
+            db.close()
+
+        if errors:
+            raise errors[0]
+        assert not overbooked, f"{overbooked} sessions overbooked"
+        assert booked + waiting == requests, f"{requests - booked - waiting} requests lost"
+        latencies.sort()
+        results = {f'{mode}_per_second': requests / elapsed,
+                   f'{mode}_mean_ms': sum(latencies) / len(latencies) * 1000,
+                   f'{mode}_p95_ms': latencies[int(len(latencies) * 0.95)] * 1000,
+                   f'{mode}_max_ms': latencies[-1] * 1000}
+        if mode != 'direct':
+            results.update({f'{mode}_max_depth': report['max_depth'],
+                            f'{mode}_mean_wait_ms': report['mean_wait_ms'],
+                            f'{mode}_mean_batch': report['mean_batch']})
+        return results
+
+    results = {'requests': requests, 'threads': threads}
+    for mode in ('direct', 'queued', 'lottery'):
+        results.update(burst(mode))
+    return results
+
+
+def benchmark_series(courts=6, slots=3, days=6):
+    """A multi-court block booked one slot per transaction against one book_series call"""
+    from repository import Repository
+    from schedule import series_slots
+    from SessionGenerator import SessionGenerator
+    from timecodes import format_minutes
+
+    # Fill every place of the block on each of `days` days, one player per place
+    first_day = (datetime.now() + timedelta(days=1)).date()
+    start_time = datetime.strptime('07:00', '%H:%M').time()
+    players = days * SESSION_CAPACITY
+    results = {'occurrences': courts * slots}
+    for mode in ('per_slot', 'series'):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Database(os.path.join(tmp, f"{mode}.db"))
+            SessionGenerator(db).run_once()
+            player_ids = [db.add_player(f"Player {i}", f"p{i}@example.com", "secret1") for i in range(players)]
+            repository = Repository(db)
+            repository.schedule.load()
+            statements = []
+            conn = db.get_connection()
+            conn.set_trace_callback(statements.append)
+            start = time.perf_counter()
+            for index, player_id in enumerate(player_ids):
+                day = first_day + timedelta(days=index // SESSION_CAPACITY)
+                occurrences = series_slots(list(range(1, courts + 1)), day, start_time, slots)
+                if mode == 'series':
+                    with repository.unit_of_work() as uow:
+                        assert not uow.book_series(player_id, occurrences)
+                else:
+                    for court_id, date, minute in occurrences:
+                        with repository.unit_of_work() as uow:
+                            uow.book(player_id, court_id, date, format_minutes(minute))
+            elapsed = time.perf_counter() - start
+            conn.set_trace_callback(None)
+            assert not db.check_occupancy_counters()
+            db.close()
+        results[f'{mode}_ms'] = elapsed * 1000 / players
+        results[f'{mode}_statements'] = len(statements) / players
+        results[f'{mode}_commits'] = sum(sql == 'COMMIT' for sql in statements) / players
+    return results
+
+
+def _profile(func, repeat):
+    """Mean, median and 95th percentile wall time of func() in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {'mean_ms': sum(samples) / repeat, 'p50_ms': samples[repeat // 2],
+            'p95_ms': samples[min(repeat - 1, int(repeat * 0.95))], 'repeat': repeat}
+
+
+def _suite_database(db, rng, player_ids, repeat):
+    from schedule import time_slots
+
+    today = datetime.now().date()
+    day = lambda: str(today + timedelta(days=rng.randint(0, 6)))
+    emails = iter(f"suite{i}@example.com" for i in range(repeat))
+    return {
+        'db.get_connection': _profile(db.get_connection, repeat),
+        'db.occupancy_version': _profile(db.occupancy_version, repeat),
+        'db.check_email_exists': _profile(lambda: db.check_email_exists(f"player{rng.choice(player_ids)}@example.com"), repeat),
+        'db.add_player': _profile(lambda: db.add_player("Suite", next(emails), "secret1"), repeat),
+        'db.get_available_sessions': _profile(lambda: db.get_available_sessions(day()), repeat),
+        'db.update_player_status': _profile(lambda: db.update_player_status(rng.choice(player_ids), warnings=1), repeat),
+        'db.get_player_bookings': _profile(lambda: db.get_player_bookings(rng.choice(player_ids)), repeat),
+        'db.iter_player_bookings_first_row': _profile(lambda: next(db.iter_player_bookings(rng.choice(player_ids)), None), repeat),
+        'db.generate_sessions_existing_day': _profile(lambda: db.generate_sessions([day()], time_slots()), 5),
+        'db.check_occupancy_counters': _profile(db.check_occupancy_counters, 5),
+        'db.delete_player_by_email': _profile(lambda: db.delete_player_by_email(f"suite{rng.randrange(repeat)}@example.com"), repeat),
+    }
+
+
+def _suite_booking(db, rng, player_ids, repeat):
+    from BookingSystem import BookingSystem
+    from schedule import time_slots
+
+    booking_system = BookingSystem(db)
+    today = datetime.now().date()
+    starts = [datetime.strptime(start, '%H:%M').time() for start, _ in time_slots()]
+    with db.get_connection() as conn:
+        courts = [row[0] for row in conn.execute('SELECT id FROM courts')]
+
+    def book():
+        booking_system.book_session(rng.choice(player_ids), rng.choice(courts),
+                                    today + timedelta(days=rng.randint(1, 6)), rng.choice(starts))
+
+    now = datetime.now()
+    return {
+        'booking.book_session': _profile(book, repeat),
+        'booking.check_late_arrivals_full_day': _profile(lambda: booking_system.check_late_arrivals(now), 1),
+        'booking.check_late_arrivals_tick': _profile(
+            lambda: booking_system.check_late_arrivals(now, since=now - timedelta(minutes=1)), repeat),
+    }
+
+
+def _suite_notifications(db, rng, player_ids, repeat):
+    from NotificationSystem import NotificationSystem
+
+    # With an email config, mail is only queued in the outbox; no SMTP server is contacted
+    notifications = NotificationSystem({'sender': 'bench@example.com'}, db)
+    session_info = {'court': 1, 'date': str(datetime.now().date()), 'start_time': '07:00', 'end_time': '09:00'}
+    return {
+        'notify.booking_confirmation': _profile(
+            lambda: notifications.notify_booking_confirmation(rng.choice(player_ids), session_info), repeat),
+        'notify.late_warning': _profile(lambda: notifications.notify_late_warning(rng.choice(player_ids)), repeat),
+        'notify.fine': _profile(lambda: notifications.notify_fine(rng.choice(player_ids), "No-show"), repeat),
+        'notify.waiting_list_spot': _profile(
+            lambda: notifications.notify_waiting_list_spot(rng.choice(player_ids), session_info), repeat),
+        'notify.many_100': _profile(lambda: notifications.notify_many(
+            [(player_id, 'late_warning') for player_id in rng.sample(player_ids, 100)]), max(1, repeat // 10)),
+    }
+
+
+def _suite_routes(db, rng, repeat):
+    # Register the routes without create_app(), so they serve the suite's database and nothing starts
+    import app as web
+    import routes
+    from hashing import hasher
+    from repository import Repository
+    from schedule import time_slots
+    from timecodes import to_day
+
+    web.repository = routes.repository = repository = Repository(db)
+    app = web.app
+    today = datetime.now().date()
+    password_hash = hasher.hash('secret1')
+    with repository.unit_of_work() as uow:
+        user_id = uow.add_player('bench', 'bench@example.com', password_hash, username='bench')
+        # A booking history long enough to need several dashboard pages
+        uow.conn.execute('''
+            INSERT INTO bookings (player_id, session_id)
+            SELECT ?, id FROM sessions WHERE day < ? ORDER BY id LIMIT 200
+        ''', (user_id, to_day(today)))
+    client = app.test_client()
+    results = {'route.login': _profile(
+        lambda: client.post('/login', data={'username': 'bench', 'password': 'secret1'}), 3)}
+    # Each POST books a different session; full ones put the user on the waiting list
+    sessions = iter((court, today + timedelta(days=offset), start, end)
+                    for offset in range(1, 8) for court in range(1, 7) for start, end in time_slots())
+
+    def post_booking():
+        court, date, start, end = next(sessions)
+        client.post('/book', data={'court_number': court, 'date': date.isoformat(),
+                                   'start_time': start, 'end_time': end})
+
+    for name, path in [('dashboard', '/dashboard'), ('book_form', '/book'),
+                       ('api_availability', f'/api/availability/{today}'),
+                       ('api_free_slots', f'/api/free-slots/{today}'),
+                       ('api_earliest_slots', '/api/earliest-slots?min_free=2&limit=10')]:
+        results[f'route.{name}'] = _profile(lambda: client.get(path), repeat)
+    results['route.book_submit'] = _profile(post_booking, repeat)
+    return results
+
+
+def benchmark_suite(players=1000, weeks=2, repeat=50, seed=0):
+    """Time the database, booking, notification and web layers against a synthetic workload"""
+    from workload import generate_workload
+
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "suite.db"))
+        start = time.perf_counter()
+        counts = generate_workload(db, players=players, weeks=weeks, seed=seed)
+        counts['generate_seconds'] = time.perf_counter() - start
+        with db.get_connection() as conn:
+            player_ids = [row[0] for row in conn.execute('SELECT id FROM players')]
+
+        results = {}
+        # The timed code reports to stdout; keep that out of the results listing
+        with contextlib.redirect_stdout(io.StringIO()):
+            results.update(_suite_database(db, rng, player_ids, repeat))
+            results.update(_suite_booking(db, rng, player_ids, repeat))
+            results.update(_suite_notifications(db, rng, player_ids, repeat))
+            results.update(_suite_routes(db, rng, repeat))
+        db.close()
+        return {'scale': {'players': players, 'weeks': weeks, 'repeat': repeat, 'seed': seed},
+                'workload': counts, 'results': results}
+
+
+def write_results(path, runs):
+    """Write suite runs to JSON along with what is needed to compare them across commits"""
+    import json
+    import platform
+    import sqlite3
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    with open(path, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'runs': runs,
+        }, f, indent=2)
+
+
+if __name__ == "__main__":
+    # Usage: python benchmark.py suite results.json [players ...]
+    if len(sys.argv) > 2 and sys.argv[1] == 'suite':
+        runs = [benchmark_suite(players=int(players)) for players in sys.argv[3:] or [1000]]
+        write_results(sys.argv[2], runs)
+        for run in runs:
+            print(f"players={run['scale']['players']}")
+            for name, stats in run['results'].items():
+                print(f"    {name:40s} {stats['mean_ms']:10.3f} ms")
+        sys.exit(0)
+
+    for name, value in benchmark_startup().items():
+        print(f"{name:32s} {value:8.3f}")
+    for name, value in stress_booking().items():
+        print(f"{name:32s} {value:8.3f}")
+    for name, value in benchmark_outbox().items():
+        print(f"{name:32s} {value:8.3f}")
+    for name, value in benchmark_login().items():
+        print(f"{name:32s} {value:8.3f}")
+    for name, value in benchmark_search().items():
+        print(f"{name:32s} {value:8.3f}")
+    for name, value in benchmark_session_generation().items():
+        print(f"{name:32s} {value:8.3f}")
+    for name, value in stress_waiting_list().items():
+        print(f"{name:32s} {value:8.3f}")
+    for name, value in benchmark_schedule_model().items():
+        print(f"{name:32s} {value:8.3f}")
+    for name, value in benchmark_change_feed().items():
+        print(f"{name:32s} {value:8.3f}")
+    for name, value in stress_admission().items():
+        print(f"{name:32s} {value:8.3f}")
+    for name, value in benchmark_series().items():
+        print(f"{name:32s} {value:8.3f}")
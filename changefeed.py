@@ -0,0 +1,184 @@
+import threading
+from collections import deque
+from database import Database, SESSION_CAPACITY
+from timecodes import format_minutes, from_day
+
+# Coalesced deltas kept in memory so resuming clients are served without a query
+BUFFER_SIZE = 5000
+
+# One row per session touched by events in (after, upto], at its latest event id
+DELTA_QUERY = '''
+    SELECT e.session_id, MAX(e.id), c.court_number, s.day, s.start_minute, s.end_minute,
+           s.booked_count, s.waiting_count, (
+               SELECT COUNT(*) FROM bookings
+               WHERE session_id = s.id AND status = 'pending_confirmation'
+           )
+    FROM booking_events e
+    JOIN sessions s ON s.id = e.session_id
+    JOIN courts c ON c.id = s.court_id
+    WHERE e.id > ? AND e.id <= ?
+    GROUP BY e.session_id
+    ORDER BY MAX(e.id)
+'''
+
+
+class ChangeFeed:
+    """Availability deltas read from the booking_events table, for live clients.
+
+    A single poller thread per process follows the table and wakes every
+    waiting client, so a screen or browser tab costs nothing until a session
+    actually changes. Each delta carries the current counts of one court and
+    slot, keyed by the id of the latest event it covers; a client that
+    reconnects with that id gets exactly the sessions changed since, or a
+    reset if those events were already pruned.
+    """
+
+    def __init__(self, db=None, interval=0.5, buffer_size=BUFFER_SIZE, name='change_feed'):
+        self.db = db or Database()
+        self.interval = interval
+        self.name = name
+        self._buffer = deque()  # deltas in event id order
+        self._buffer_size = buffer_size
+        self._floor = None  # Deltas after this event id are all in the buffer
+        self._head = None  # Highest event id read so far
+        self._condition = threading.Condition()
+        self._poll_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def last_id(self):
+        """Id of the newest event in the database, 0 if there are none"""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM booking_events')
+            return cursor.fetchone()[0]
+
+    def deltas(self, after, upto):
+        """Current availability of every session with events in (after, upto]"""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(DELTA_QUERY, (after, upto))
+            rows = cursor.fetchall()
+        return [{'id': event_id, 'date': str(from_day(day)), 'court': court,
+                 'start': format_minutes(start), 'end': format_minutes(end),
+                 'booked': booked, 'waiting': waiting,
+                 'free': max(0, SESSION_CAPACITY - booked - pending)}
+                for _, event_id, court, day, start, end, booked, waiting, pending in rows]
+
+    def poll(self):
+        """Buffer the deltas committed since the last poll and wake the followers"""
+        with self._poll_lock:
+            latest = self.last_id()
+            if self._head is None:
+                with self._condition:
+                    self._head = self._floor = latest
+                return []
+            if latest <= self._head:
+                return []
+            fresh = self.deltas(self._head, latest)
+            with self._condition:
+                self._buffer.extend(fresh)
+                while len(self._buffer) > self._buffer_size:
+                    self._floor = self._buffer.popleft()['id']
+                self._head = latest
+                self._condition.notify_all()
+            return fresh
+
+    def notify(self):
+        """Poll straight away instead of at the next interval, e.g. after a local commit"""
+        self._wake.set()
+
+    def _oldest_retained(self):
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT MIN(id) FROM booking_events')
+            return cursor.fetchone()[0]
+
+    def since(self, after_id):
+        """(head, deltas after `after_id`, one per session); deltas is None if the client must reset"""
+        with self._condition:
+            head, floor = self._head, self._floor
+            if floor is not None and floor <= after_id <= head:
+                latest = {}
+                for delta in self._buffer:
+                    if delta['id'] > after_id:
+                        latest[(delta['date'], delta['court'], delta['start'])] = delta
+                return head, sorted(latest.values(), key=lambda delta: delta['id'])
+
+        head = self.last_id()
+        if after_id > head:
+            # An id from another database, or from before the events were cleared
+            return head, None
+        oldest = self._oldest_retained()
+        if oldest is not None and after_id < oldest - 1:
+            return head, None
+        return head, self.deltas(after_id, head)
+
+    def wait(self, after_id, timeout=None):
+        """Block until events newer than `after_id` are buffered; False on timeout"""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._head is not None and self._head > after_id,
+                                            timeout)
+
+    def follow(self, after_id=None, heartbeat=15, date=None):
+        """Yield ('delta', id, delta), ('reset', id, None) or ('heartbeat', id, None) forever.
+
+        Starts after `after_id`, or at the current head when it is None, and
+        only passes on deltas for `date` ('YYYY-MM-DD') when one is given.
+        """
+        self.start()
+        position = self._head if after_id is None else after_id
+        while True:
+            head, deltas = self.since(position)
+            if deltas is None:
+                yield 'reset', head, None
+            else:
+                for delta in deltas:
+                    if date is None or delta['date'] == date:
+                        yield 'delta', delta['id'], delta
+            position = head
+            if not self.wait(position, heartbeat):
+                yield 'heartbeat', position, None
+
+    def run_forever(self):
+        """Poll every `interval` seconds, or sooner when notified, until stop() is called"""
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Change feed poll failed: {str(e)}")
+            self._wake.wait(self.interval)
+
+    def start(self):
+        """Start the shared poller thread if it is not running yet"""
+        with self._poll_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name=self.name, daemon=True)
+            self._thread.start()
+        # Followers that start at the head need it before the first interval
+        self.poll()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+if __name__ == "__main__":
+    # Courts screen: print each court and slot as its availability changes
+    feed = ChangeFeed()
+    try:
+        for kind, event_id, delta in feed.follow():
+            if kind == 'delta':
+                print(f"{delta['date']} {delta['start']}-{delta['end']} Court {delta['court']}: "
+                      f"{delta['booked']} booked, {delta['free']} free, {delta['waiting']} waiting")
+            elif kind == 'reset':
+                print("Feed restarted; reload the full schedule")
+    except KeyboardInterrupt:
+        feed.stop()
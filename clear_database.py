@@ -1,14 +1,14 @@
-from app import app, db, User, Booking
+from database import Database
 
 def clear_database():
-    with app.app_context():
-        # Delete all bookings first (due to foreign key constraints)
-        Booking.query.delete()
+    db = Database()
+    with db.transaction() as conn:
+        # Delete bookings and waiting-list entries first, as they reference players
+        conn.execute('DELETE FROM bookings')
+        conn.execute('DELETE FROM waiting_list')
         # Delete all users
-        User.query.delete()
-        # Commit the changes
-        db.session.commit()
-        print("All users and bookings have been deleted from the database.")
+        conn.execute('DELETE FROM players')
+    print("All users and bookings have been deleted from the database.")
 
 if __name__ == "__main__":
     clear_database()
@@ -1,99 +1,824 @@
+import os
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from metrics import metrics
+from timecodes import format_minutes, from_day, to_day, to_minutes
+
+# Players per session before further bookings go to the waiting list
+SESSION_CAPACITY = 6
+
+# Booking statuses counted in sessions.booked_count; with open waiting-list offers
+# ('pending_confirmation') they are the places a session has taken
+BOOKED_STATUSES = ('booked', 'late')
+
+# Most recent booking_events rows kept for clients resuming the change feed
+EVENT_RETENTION = 100000
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that records how long each statement takes to produce its first row"""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.observe_query('sqlite', sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            metrics.observe_query('sqlite', sql, time.perf_counter() - start)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors, including the implicit ones, are TimedCursors.
+
+    While Database.transaction() or snapshot() holds the connection, `with
+    conn` blocks and commit() calls in the code it runs join that outer
+    transaction instead of ending it early.
+    """
+    held = False
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.held:
+            return False
+        return super().__exit__(exc_type, exc_value, traceback)
+
+    def commit(self):
+        if not self.held:
+            super().commit()
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class ConnectionPool:
+    """Per-thread SQLite connections shared by every Database on the same file"""
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, db_file, timeout=30.0, cached_statements=256):
+        self.db_file = db_file
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.pid = os.getpid()
+        self._connections = {}  # thread ident -> (thread, connection)
+        self._lock = threading.Lock()
+        self.schema_ready = False
+
+        # WAL is persistent in the database file, so it only needs setting once
+        with self.connection() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+
+    @classmethod
+    def for_file(cls, db_file):
+        """Return the process-wide pool for a database file, creating it once per process"""
+        key = db_file if db_file == ':memory:' else os.path.abspath(db_file)
+        with cls._pools_lock:
+            pool = cls._pools.get(key)
+            # A forked worker must not reuse connections inherited from its parent
+            if pool is None or pool.pid != os.getpid():
+                pool = cls._pools[key] = cls(db_file)
+            return pool
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_file,
+            timeout=self.timeout,
+            cached_statements=self.cached_statements,
+            check_same_thread=False,
+            factory=TimedConnection
+        )
+        metrics.inc('db_connections_opened_total', source='sqlite')
+        conn.execute(f'PRAGMA busy_timeout = {int(self.timeout * 1000)}')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    def connection(self):
+        """Return the calling thread's connection, opening it on first use"""
+        thread = threading.current_thread()
+        entry = self._connections.get(thread.ident)
+        if entry is not None and entry[0] is thread:
+            return entry[1]
+
+        conn = self._connect()
+        with self._lock:
+            self._prune()
+            self._connections[thread.ident] = (thread, conn)
+        metrics.add_gauge('db_connections_open', 1, source='sqlite')
+        return conn
+
+    def _prune(self):
+        """Close connections left behind by threads that have exited"""
+        for ident, (thread, conn) in list(self._connections.items()):
+            if not thread.is_alive():
+                conn.close()
+                del self._connections[ident]
+                metrics.add_gauge('db_connections_open', -1, source='sqlite')
+
+    def close_all(self):
+        with self._lock:
+            for thread, conn in self._connections.values():
+                conn.close()
+            metrics.add_gauge('db_connections_open', -len(self._connections), source='sqlite')
+            self._connections.clear()
+
+
+def _migrate_v1(cursor):
+    """Baseline schema: players, courts, sessions, bookings, waiting list, notifications"""
+    # Create Players table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS players (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT UNIQUE,
+            password TEXT NOT NULL,
+            warnings INTEGER DEFAULT 0,
+            fines DECIMAL DEFAULT 0.0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Create Courts table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS courts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            court_number INTEGER UNIQUE NOT NULL
+        )
+    ''')
+
+    # Create Sessions table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            court_id INTEGER,
+            start_time TIME NOT NULL,
+            end_time TIME NOT NULL,
+            date DATE NOT NULL,
+            FOREIGN KEY (court_id) REFERENCES courts (id),
+            UNIQUE(court_id, start_time, date)
+        )
+    ''')
+
+    # Create Bookings table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS bookings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            player_id INTEGER,
+            session_id INTEGER,
+            status TEXT DEFAULT 'booked',
+            is_substitute BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (player_id) REFERENCES players (id),
+            FOREIGN KEY (session_id) REFERENCES sessions (id)
+        )
+    ''')
+
+    # Create WaitingList table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS waiting_list (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            player_id INTEGER,
+            session_id INTEGER,
+            position INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (player_id) REFERENCES players (id),
+            FOREIGN KEY (session_id) REFERENCES sessions (id)
+        )
+    ''')
+
+    # Create Notifications table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            player_id INTEGER,
+            type TEXT NOT NULL,
+            message TEXT NOT NULL,
+            status TEXT DEFAULT 'sent',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (player_id) REFERENCES players (id)
+        )
+    ''')
+
+    # Initialize courts if they don't exist
+    cursor.execute('SELECT COUNT(*) FROM courts')
+    if cursor.fetchone()[0] == 0:
+        for i in range(1, 7):
+            cursor.execute('INSERT INTO courts (court_number) VALUES (?)', (i,))
+
+
+def _migrate_v2(cursor):
+    """Secondary indexes for the hot booking, availability and waiting-list queries"""
+    # Sessions by day, covering the per-day slot and court lookups
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sessions_date
+        ON sessions (date, start_time, court_id)
+    ''')
+
+    # Occupancy counts per session and status
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_session_status
+        ON bookings (session_id, status)
+    ''')
+
+    # A player's booking history
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_player
+        ON bookings (player_id, session_id, status)
+    ''')
+
+    # Next waiting-list position and promotion order
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_waiting_list_session_position
+        ON waiting_list (session_id, position)
+    ''')
+
+
+def _migrate_v3(cursor):
+    """Per-session booked_count kept in step with 'booked' rows by triggers"""
+    cursor.execute('ALTER TABLE sessions ADD COLUMN booked_count INTEGER NOT NULL DEFAULT 0')
+    cursor.execute('''
+        UPDATE sessions SET booked_count = (
+            SELECT COUNT(*) FROM bookings
+            WHERE session_id = sessions.id AND status = 'booked'
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_insert_count
+        AFTER INSERT ON bookings WHEN NEW.status = 'booked'
+        BEGIN
+            UPDATE sessions SET booked_count = booked_count + 1 WHERE id = NEW.session_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_delete_count
+        AFTER DELETE ON bookings WHEN OLD.status = 'booked'
+        BEGIN
+            UPDATE sessions SET booked_count = booked_count - 1 WHERE id = OLD.session_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_update_count
+        AFTER UPDATE OF status, session_id ON bookings
+        WHEN OLD.status IS NOT NEW.status OR OLD.session_id IS NOT NEW.session_id
+        BEGIN
+            UPDATE sessions SET booked_count = booked_count - 1
+            WHERE id = OLD.session_id AND OLD.status = 'booked';
+            UPDATE sessions SET booked_count = booked_count + 1
+            WHERE id = NEW.session_id AND NEW.status = 'booked';
+        END
+    ''')
+
+
+def _migrate_v4(cursor):
+    """Persisted watermarks for background jobs"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS job_state (
+            name TEXT PRIMARY KEY,
+            watermark TIMESTAMP NOT NULL
+        )
+    ''')
+
+
+def _migrate_v5(cursor):
+    """Durable outbox for emails sent by background workers"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            to_email TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        )
+    ''')
+
+    # Workers claim the oldest due messages first
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_email_outbox_due
+        ON email_outbox (status, next_attempt_at)
+    ''')
+
+
+def _migrate_v6(cursor):
+    """Per-session waiting_count kept in step with waiting_list rows by triggers"""
+    cursor.execute('ALTER TABLE sessions ADD COLUMN waiting_count INTEGER NOT NULL DEFAULT 0')
+    cursor.execute('''
+        UPDATE sessions SET waiting_count = (
+            SELECT COUNT(*) FROM waiting_list WHERE session_id = sessions.id
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_waiting_list_insert_count
+        AFTER INSERT ON waiting_list
+        BEGIN
+            UPDATE sessions SET waiting_count = waiting_count + 1 WHERE id = NEW.session_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_waiting_list_delete_count
+        AFTER DELETE ON waiting_list
+        BEGIN
+            UPDATE sessions SET waiting_count = waiting_count - 1 WHERE id = OLD.session_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_waiting_list_update_count
+        AFTER UPDATE OF session_id ON waiting_list
+        WHEN OLD.session_id IS NOT NEW.session_id
+        BEGIN
+            UPDATE sessions SET waiting_count = waiting_count - 1 WHERE id = OLD.session_id;
+            UPDATE sessions SET waiting_count = waiting_count + 1 WHERE id = NEW.session_id;
+        END
+    ''')
+
+
+# (name, event) for every trigger that bumps occupancy_version
+VERSION_TRIGGERS = [
+    ('sessions_insert', 'INSERT ON sessions'),
+    ('sessions_delete', 'DELETE ON sessions'),
+    ('sessions_update', 'UPDATE OF booked_count, waiting_count ON sessions'),
+    ('courts_insert', 'INSERT ON courts'),
+    ('courts_delete', 'DELETE ON courts'),
+]
+
+# Waiting-list offers hold places without touching booked_count, so they bump it too
+OFFER_VERSION_TRIGGERS = [
+    ('bookings_offer_insert', "INSERT ON bookings WHEN NEW.status = 'pending_confirmation'"),
+    ('bookings_offer_delete', "DELETE ON bookings WHEN OLD.status = 'pending_confirmation'"),
+    ('bookings_offer_update', "UPDATE OF status, session_id ON bookings "
+                              "WHEN 'pending_confirmation' IN (OLD.status, NEW.status)"),
+]
+
+
+# (name, event) for every trigger that bumps schedule_version
+SCHEDULE_TRIGGERS = [
+    ('schedule_courts_insert', 'INSERT ON courts'),
+    ('schedule_courts_delete', 'DELETE ON courts'),
+    ('schedule_sessions_insert', 'INSERT ON sessions'),
+    ('schedule_sessions_delete', 'DELETE ON sessions'),
+    ('schedule_sessions_update', 'UPDATE OF court_id, day, start_minute, end_minute ON sessions'),
+    ('schedule_bookings_insert', 'INSERT ON bookings'),
+    ('schedule_bookings_delete', 'DELETE ON bookings'),
+    ('schedule_bookings_update', 'UPDATE OF player_id, session_id, status ON bookings'),
+    ('schedule_waiting_list_insert', 'INSERT ON waiting_list'),
+    ('schedule_waiting_list_delete', 'DELETE ON waiting_list'),
+    ('schedule_waiting_list_update', 'UPDATE OF player_id, session_id, position ON waiting_list'),
+    ('schedule_players_update', 'UPDATE OF name, warnings, fines ON players'),
+    ('schedule_players_delete', 'DELETE ON players'),
+]
+
+
+def _create_version_triggers(cursor, triggers, table='occupancy_version'):
+    for name, event in triggers:
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{name}_version
+            AFTER {event}
+            BEGIN
+                UPDATE {table} SET version = version + 1 WHERE id = 1;
+            END
+        ''')
+
+
+def _migrate_v7(cursor):
+    """Counter bumped by triggers whenever session occupancy or the court list changes"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS occupancy_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO occupancy_version (id, version) VALUES (1, 0)')
+
+    _create_version_triggers(cursor, VERSION_TRIGGERS)
+
+
+def _migrate_v8(cursor):
+    """Expiry time for waiting-list offers held as 'pending_confirmation' bookings"""
+    cursor.execute('ALTER TABLE bookings ADD COLUMN offer_expires_at TIMESTAMP')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_status_offer_expiry
+        ON bookings (status, offer_expires_at)
+    ''')
+
+
+def _migrate_v9(cursor):
+    """Rebuild sessions with integer day numbers and minutes instead of text dates and times"""
+    # Keep the bookings/waiting_list trigger bodies, which name sessions, untouched by the rename
+    cursor.execute('PRAGMA legacy_alter_table = ON')
+    cursor.execute('''
+        CREATE TABLE sessions_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            court_id INTEGER,
+            day INTEGER NOT NULL,
+            start_minute INTEGER NOT NULL,
+            end_minute INTEGER NOT NULL,
+            booked_count INTEGER NOT NULL DEFAULT 0,
+            waiting_count INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (court_id) REFERENCES courts (id),
+            UNIQUE(court_id, day, start_minute)
+        )
+    ''')
+    # julianday('0001-01-01') is 1721425.5, the day before date.toordinal() == 1
+    cursor.execute('''
+        INSERT INTO sessions_new (id, court_id, day, start_minute, end_minute, booked_count, waiting_count)
+        SELECT id, court_id, CAST(julianday(date) - 1721424.5 AS INTEGER),
+               CAST(substr(start_time, 1, 2) AS INTEGER) * 60 + CAST(substr(start_time, 4, 2) AS INTEGER),
+               CAST(substr(end_time, 1, 2) AS INTEGER) * 60 + CAST(substr(end_time, 4, 2) AS INTEGER),
+               booked_count, waiting_count
+        FROM sessions
+    ''')
+    cursor.execute('DROP TABLE sessions')
+    cursor.execute('ALTER TABLE sessions_new RENAME TO sessions')
+    cursor.execute('PRAGMA legacy_alter_table = OFF')
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sessions_day
+        ON sessions (day, start_minute, court_id)
+    ''')
+    # The occupancy_version triggers on sessions went with the old table
+    _create_version_triggers(cursor, [trigger for trigger in VERSION_TRIGGERS if trigger[0].startswith('sessions_')])
+
+
+def _migrate_v10(cursor):
+    """Counter bumped by triggers whenever anything held by the in-memory schedule model changes"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schedule_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO schedule_version (id, version) VALUES (1, 0)')
+
+    _create_version_triggers(cursor, SCHEDULE_TRIGGERS, 'schedule_version')
+
+
+def _migrate_v11(cursor):
+    """Usernames for web sign-in, and the web app's old user/booking tables folded into players/bookings"""
+    cursor.execute('ALTER TABLE players ADD COLUMN username TEXT')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_players_username ON players (username)')
+
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('user', 'booking')")
+    legacy = {row[0] for row in cursor.fetchall()}
+    if 'user' not in legacy:
+        return
+    # A web account whose email the CLI already knows keeps the CLI player and password
+    cursor.execute('''
+        UPDATE players SET username = (SELECT u.username FROM "user" u WHERE u.email = players.email)
+        WHERE email IN (SELECT email FROM "user")
+    ''')
+    cursor.execute('''
+        INSERT INTO players (name, email, password, username)
+        SELECT username, email, COALESCE(password_hash, ''), username FROM "user"
+        WHERE email NOT IN (SELECT email FROM players WHERE email IS NOT NULL)
+    ''')
+    if 'booking' in legacy:
+        _import_legacy_bookings(cursor)
+
+
+def _import_legacy_bookings(cursor):
+    """Each web booking becomes a place in every session its time range overlaps.
+
+    Sessions are generated for the legacy courts and dates first, since the
+    migration runs before any SessionGenerator. Places beyond
+    SESSION_CAPACITY go on the waiting list, and bookings that still match
+    no session are reported and left in the old booking table.
+    """
+    from schedule import time_slots
+
+    cursor.execute('INSERT OR IGNORE INTO courts (court_number) SELECT DISTINCT court_number FROM booking')
+    slots = [(to_minutes(start), to_minutes(end)) for start, end in time_slots()]
+    cursor.execute('''
+        SELECT DISTINCT c.id, CAST(julianday(lb.date) - 1721424.5 AS INTEGER)
+        FROM booking lb JOIN courts c ON c.court_number = lb.court_number
+        WHERE lb.date IS NOT NULL
+    ''')
+    cursor.executemany('''
+        INSERT INTO sessions (court_id, day, start_minute, end_minute)
+        SELECT ?1, ?2, ?3, ?4
+        WHERE NOT EXISTS (
+            SELECT 1 FROM sessions WHERE court_id = ?1 AND day = ?2 AND start_minute = ?3
+        )
+    ''', [(court_id, day, start, end) for court_id, day in cursor.fetchall() for start, end in slots])
+
+    cursor.execute('''
+        SELECT lb.id, p.id, s.id
+        FROM booking lb
+        JOIN "user" u ON u.id = lb.user_id
+        JOIN players p ON p.email = u.email
+        JOIN courts c ON c.court_number = lb.court_number
+        JOIN sessions s ON s.court_id = c.id
+         AND s.day = CAST(julianday(lb.date) - 1721424.5 AS INTEGER)
+         AND s.start_minute < CAST(substr(lb.end_time, 1, 2) AS INTEGER) * 60 + CAST(substr(lb.end_time, 4, 2) AS INTEGER)
+         AND s.end_minute > CAST(substr(lb.start_time, 1, 2) AS INTEGER) * 60 + CAST(substr(lb.start_time, 4, 2) AS INTEGER)
+        ORDER BY lb.id, s.id
+    ''')
+    matches = cursor.fetchall()
+
+    # Places already held per session, and the last waiting-list position
+    held, positions = {}, {}
+    for session_id in {session_id for _, _, session_id in matches}:
+        cursor.execute('''
+            SELECT COUNT(*) FROM bookings
+            WHERE session_id = ? AND status IN ('booked', 'late', 'pending_confirmation')
+        ''', (session_id,))
+        held[session_id] = cursor.fetchone()[0]
+        cursor.execute('SELECT COALESCE(MAX(position), 0) FROM waiting_list WHERE session_id = ?', (session_id,))
+        positions[session_id] = cursor.fetchone()[0]
+
+    bookings, waiting = [], []
+    for _, player_id, session_id in matches:
+        if held[session_id] < SESSION_CAPACITY:
+            held[session_id] += 1
+            bookings.append((player_id, session_id))
+        else:
+            positions[session_id] += 1
+            waiting.append((player_id, session_id, positions[session_id]))
+    cursor.executemany("INSERT INTO bookings (player_id, session_id, status) VALUES (?, ?, 'booked')", bookings)
+    cursor.executemany('INSERT INTO waiting_list (player_id, session_id, position) VALUES (?, ?, ?)', waiting)
+
+    cursor.execute('SELECT COUNT(*) FROM booking')
+    unmatched = cursor.fetchone()[0] - len({booking_id for booking_id, _, _ in matches})
+    if unmatched:
+        print(f"Legacy import: {unmatched} web bookings match no player or session; "
+              f"they are kept in the old booking table")
+    if waiting:
+        print(f"Legacy import: {len(waiting)} web bookings exceeded session capacity "
+              f"and were put on the waiting list")
+
+
+# (table, event, session, kind) for every trigger that appends to booking_events
+EVENT_TRIGGERS = [
+    ('bookings', 'INSERT', 'NEW.session_id',
+     "CASE NEW.status WHEN 'pending_confirmation' THEN 'offered' ELSE NEW.status END"),
+    ('bookings', 'DELETE', 'OLD.session_id', "'cancelled'"),
+    ('waiting_list', 'INSERT', 'NEW.session_id', "'waitlisted'"),
+    ('waiting_list', 'DELETE', 'OLD.session_id', "'left_waiting_list'"),
+]
+
+
+def _migrate_v12(cursor):
+    """Append-only booking_events change feed, written by triggers on every occupancy change"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS booking_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    for table, event, session, kind in EVENT_TRIGGERS:
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_event
+            AFTER {event} ON {table}
+            BEGIN
+                INSERT INTO booking_events (session_id, kind) VALUES ({session}, {kind});
+            END
+        ''')
+    # Status changes: late, no_show, a confirmed or expired offer; a moved booking touches both sessions
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_update_event
+        AFTER UPDATE OF status, session_id ON bookings
+        WHEN OLD.status IS NOT NEW.status OR OLD.session_id IS NOT NEW.session_id
+        BEGIN
+            INSERT INTO booking_events (session_id, kind)
+            SELECT OLD.session_id, 'moved' WHERE OLD.session_id IS NOT NEW.session_id;
+            INSERT INTO booking_events (session_id, kind) VALUES (NEW.session_id, NEW.status);
+        END
+    ''')
+
+
+def _migrate_v13(cursor):
+    """occupancy_version also moves when a waiting-list offer is made, answered or expires"""
+    _create_version_triggers(cursor, OFFER_VERSION_TRIGGERS)
+
+
+def _migrate_v14(cursor):
+    """Each booking's session day and start minute, kept in step by triggers, so history is read in index order"""
+    cursor.execute('ALTER TABLE bookings ADD COLUMN day INTEGER')
+    cursor.execute('ALTER TABLE bookings ADD COLUMN start_minute INTEGER')
+    cursor.execute('''
+        UPDATE bookings SET (day, start_minute) = (
+            SELECT day, start_minute FROM sessions WHERE id = bookings.session_id
+        )
+    ''')
+
+    # A player's bookings by date, so keyset pages and streams seek instead of sorting
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_bookings_player_day
+        ON bookings (player_id, day, start_minute)
+    ''')
+
+    for name, event in (('insert', 'INSERT'), ('update', 'UPDATE OF session_id')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_bookings_{name}_slot
+            AFTER {event} ON bookings
+            BEGIN
+                UPDATE bookings SET (day, start_minute) = (
+                    SELECT day, start_minute FROM sessions WHERE id = NEW.session_id
+                )
+                WHERE id = NEW.id;
+            END
+        ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_sessions_update_slot
+        AFTER UPDATE OF day, start_minute ON sessions
+        BEGIN
+            UPDATE bookings SET day = NEW.day, start_minute = NEW.start_minute
+            WHERE session_id = NEW.id;
+        END
+    ''')
+
+
+def _migrate_v15(cursor):
+    """When each outbox message was claimed, so only abandoned claims are handed out again"""
+    cursor.execute('ALTER TABLE email_outbox ADD COLUMN claimed_at TIMESTAMP')
+
+
+def _migrate_v16(cursor):
+    """booked_count also counts 'late' bookings, which keep their place in the session"""
+    booked = f"({', '.join(repr(status) for status in BOOKED_STATUSES)})"
+    for name in ('insert', 'delete', 'update'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS trg_bookings_{name}_count')
+    cursor.execute(f'''
+        UPDATE sessions SET booked_count = (
+            SELECT COUNT(*) FROM bookings
+            WHERE session_id = sessions.id AND status IN {booked}
+        )
+    ''')
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_insert_count
+        AFTER INSERT ON bookings WHEN NEW.status IN {booked}
+        BEGIN
+            UPDATE sessions SET booked_count = booked_count + 1 WHERE id = NEW.session_id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_delete_count
+        AFTER DELETE ON bookings WHEN OLD.status IN {booked}
+        BEGIN
+            UPDATE sessions SET booked_count = booked_count - 1 WHERE id = OLD.session_id;
+        END
+    ''')
+    # Going from 'booked' to 'late' keeps the place, so it leaves the count (and occupancy_version) alone
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_bookings_update_count
+        AFTER UPDATE OF status, session_id ON bookings
+        WHEN (OLD.status IN {booked}) IS NOT (NEW.status IN {booked}) OR OLD.session_id IS NOT NEW.session_id
+        BEGIN
+            UPDATE sessions SET booked_count = booked_count - 1
+            WHERE id = OLD.session_id AND OLD.status IN {booked};
+            UPDATE sessions SET booked_count = booked_count + 1
+            WHERE id = NEW.session_id AND NEW.status IN {booked};
+        END
+    ''')
+
+
+# (version, migration) pairs, applied in order to databases below that version
+MIGRATIONS = [
+    (1, _migrate_v1),
+    (2, _migrate_v2),
+    (3, _migrate_v3),
+    (4, _migrate_v4),
+    (5, _migrate_v5),
+    (6, _migrate_v6),
+    (7, _migrate_v7),
+    (8, _migrate_v8),
+    (9, _migrate_v9),
+    (10, _migrate_v10),
+    (11, _migrate_v11),
+    (12, _migrate_v12),
+    (13, _migrate_v13),
+    (14, _migrate_v14),
+    (15, _migrate_v15),
+    (16, _migrate_v16),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
 
 class Database:
     def __init__(self, db_file="gym_booking.db"):
         self.db_file = db_file
+        self.pool = ConnectionPool.for_file(db_file)
         self.init_database()
 
     def get_connection(self):
-        return sqlite3.connect(self.db_file)
+        """Return the pooled connection for the current thread.
+
+        The connection stays open between calls; ``with`` blocks commit or
+        roll back as before but no longer close it.
+        """
+        if self.pool.pid != os.getpid():
+            # Forked since the pool was made: switch to this process's pool, never the parent's connections
+            self.pool = ConnectionPool.for_file(self.db_file)
+        return self.pool.connection()
+
+    def close(self):
+        """Close every pooled connection for this database file"""
+        self.pool.close_all()
 
     def init_database(self):
+        """Bring the schema up to SCHEMA_VERSION, once per process and file"""
+        # A current database costs one pragma read instead of re-running DDL
+        if self.pool.schema_ready:
+            return
+
         with self.get_connection() as conn:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < SCHEMA_VERSION:
+            self.migrate()
+        self.pool.schema_ready = True
+
+    def migrate(self):
+        """Apply pending migrations in one write transaction"""
+        with self.transaction() as conn:
+            # Re-read under the write lock in case another process just migrated
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
             cursor = conn.cursor()
-            
-            # Create Players table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS players (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    email TEXT UNIQUE,
-                    password TEXT NOT NULL,
-                    warnings INTEGER DEFAULT 0,
-                    fines DECIMAL DEFAULT 0.0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+            for target, migration in MIGRATIONS:
+                if target > version:
+                    migration(cursor)
+                    cursor.execute(f'PRAGMA user_version = {target}')
 
-            # Create Courts table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS courts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    court_number INTEGER UNIQUE NOT NULL
-                )
-            ''')
+    @contextmanager
+    def transaction(self):
+        """Run a block under BEGIN IMMEDIATE so it holds the write lock from the start.
 
-            # Create Sessions table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS sessions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    court_id INTEGER,
-                    start_time TIME NOT NULL,
-                    end_time TIME NOT NULL,
-                    date DATE NOT NULL,
-                    FOREIGN KEY (court_id) REFERENCES courts (id),
-                    UNIQUE(court_id, start_time, date)
-                )
-            ''')
+        Nested use joins the enclosing transaction instead of starting a new one.
+        """
+        conn = self.get_connection()
+        if conn.in_transaction:
+            yield conn
+            return
 
-            # Create Bookings table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS bookings (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    player_id INTEGER,
-                    session_id INTEGER,
-                    status TEXT DEFAULT 'booked',
-                    is_substitute BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (player_id) REFERENCES players (id),
-                    FOREIGN KEY (session_id) REFERENCES sessions (id)
-                )
-            ''')
+        # Time spent here is time spent waiting for other writers to commit
+        # (recorded as lock wait only, not as a slow statement)
+        start = time.perf_counter()
+        sqlite3.Connection.execute(conn, 'BEGIN IMMEDIATE')
+        metrics.observe_lock_wait('sqlite', time.perf_counter() - start)
+        conn.held = True
+        try:
+            yield conn
+        except BaseException:
+            conn.held = False
+            conn.rollback()
+            raise
+        conn.held = False
+        conn.commit()
 
-            # Create WaitingList table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS waiting_list (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    player_id INTEGER,
-                    session_id INTEGER,
-                    position INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (player_id) REFERENCES players (id),
-                    FOREIGN KEY (session_id) REFERENCES sessions (id)
-                )
-            ''')
+    @contextmanager
+    def snapshot(self):
+        """Run a block of reads against one consistent view of the database.
 
-            # Create Notifications table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS notifications (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    player_id INTEGER,
-                    type TEXT NOT NULL,
-                    message TEXT NOT NULL,
-                    status TEXT DEFAULT 'sent',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (player_id) REFERENCES players (id)
-                )
-            ''')
+        A deferred transaction takes no write lock, so under WAL writers carry
+        on while the block sees the state as of its first read. Nested use
+        joins the enclosing transaction.
+        """
+        conn = self.get_connection()
+        if conn.in_transaction:
+            yield conn
+            return
 
-            # Initialize courts if they don't exist
-            cursor.execute('SELECT COUNT(*) FROM courts')
-            if cursor.fetchone()[0] == 0:
-                for i in range(1, 7):
-                    cursor.execute('INSERT INTO courts (court_number) VALUES (?)', (i,))
+        sqlite3.Connection.execute(conn, 'BEGIN DEFERRED')
+        conn.held = True
+        try:
+            yield conn
+        finally:
+            conn.held = False
+            conn.rollback()
 
-            conn.commit()
+    def occupancy_version(self):
+        """Counter that changes whenever any session's occupancy or the court list does"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT version FROM occupancy_version WHERE id = 1')
+            return cursor.fetchone()[0]
+
+    def schedule_version(self):
+        """Counter that changes whenever a court, session, booking, waiting-list entry or player does"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT version FROM schedule_version WHERE id = 1')
+            return cursor.fetchone()[0]
 
     def check_email_exists(self, email):
         """Check if an email already exists in the database"""
@@ -102,7 +827,7 @@ class Database:
             cursor.execute('SELECT COUNT(*) FROM players WHERE email = ?', (email,))
             return cursor.fetchone()[0] > 0
 
-    def add_player(self, name, email, password):
+    def add_player(self, name, email, password, username=None):
         """Add a new player to the database"""
         if self.check_email_exists(email):
             raise ValueError("Email already exists")
@@ -111,8 +836,8 @@ class Database:
             cursor = conn.cursor()
             try:
                 cursor.execute(
-                    'INSERT INTO players (name, email, password) VALUES (?, ?, ?)',
-                    (name, email, password)
+                    'INSERT INTO players (name, email, password, username) VALUES (?, ?, ?, ?)',
+                    (name, email, password, username)
                 )
                 return cursor.lastrowid
             except sqlite3.IntegrityError:
@@ -122,25 +847,136 @@ class Database:
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                SELECT s.id, c.court_number, s.start_time, s.end_time,
-                       (SELECT COUNT(*) FROM bookings WHERE session_id = s.id AND status = 'booked') as player_count
+                SELECT s.id, c.court_number, s.start_minute, s.end_minute, s.booked_count as player_count
                 FROM sessions s
                 JOIN courts c ON s.court_id = c.id
-                WHERE s.date = ?
-                ORDER BY s.start_time, c.court_number
-            ''', (date,))
-            return cursor.fetchall()
+                WHERE s.day = ?
+                ORDER BY s.start_minute, c.court_number
+            ''', (to_day(date),))
+            return [(session_id, court, format_minutes(start), format_minutes(end), count)
+                    for session_id, court, start, end, count in cursor.fetchall()]
+
+    def book_slot(self, player_id, court_id, date, start_time):
+        """Book the pre-generated session for a court slot"""
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id FROM sessions
+                WHERE court_id = ? AND day = ? AND start_minute = ?
+            ''', (court_id, to_day(date), to_minutes(start_time)))
+            session = cursor.fetchone()
+            if session is None:
+                raise ValueError("No session scheduled for that court and time")
+            return self.create_booking(player_id, session[0])
+
+    def book_series(self, player_id, occurrences, earliest=None, latest=None):
+        """Book a place in every (court_id, date, start_time) occurrence, or in none of them.
+
+        One query checks every occurrence against its session and counters and
+        one executemany inserts the bookings. Returns (session ids booked,
+        conflicts); a conflict is (court_id, date, 'HH:MM', reason) and
+        nothing is written unless there are none. Occurrences starting before
+        `earliest` or after `latest` are conflicts too.
+        """
+        wanted = list(dict.fromkeys((court_id, to_day(date), to_minutes(start_time))
+                                    for court_id, date, start_time in occurrences))
+        if not wanted:
+            return [], []
+        # A (day, minute) key compares like the datetime it came from
+        bounds = [None if moment is None else (to_day(moment), to_minutes(moment))
+                  for moment in (earliest, latest)]
+
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                WITH wanted(court_id, day, start_minute) AS (VALUES {','.join(['(?, ?, ?)'] * len(wanted))})
+                SELECT w.court_id, w.day, w.start_minute, s.id, s.booked_count + (
+                           SELECT COUNT(*) FROM bookings
+                           WHERE session_id = s.id AND status = 'pending_confirmation'
+                       ), EXISTS (
+                           SELECT 1 FROM bookings
+                           WHERE player_id = ? AND session_id = s.id
+                             AND status IN ('booked', 'late', 'pending_confirmation')
+                       )
+                FROM wanted w
+                LEFT JOIN sessions s
+                  ON s.court_id = w.court_id AND s.day = w.day AND s.start_minute = w.start_minute
+            ''', [value for occurrence in wanted for value in occurrence] + [player_id])
+            found = {row[:3]: row[3:] for row in cursor.fetchall()}
+
+            session_ids, conflicts = [], []
+            for court_id, day, start in wanted:
+                session_id, held, mine = found[(court_id, day, start)]
+                if (bounds[0] and (day, start) < bounds[0]) or (bounds[1] and (day, start) > bounds[1]):
+                    reason = "Outside the booking window"
+                elif session_id is None:
+                    reason = "No session scheduled for that court and time"
+                elif mine:
+                    reason = "Already booked"
+                elif held >= SESSION_CAPACITY:
+                    reason = "Session is full"
+                else:
+                    session_ids.append(session_id)
+                    continue
+                conflicts.append((court_id, from_day(day), format_minutes(start), reason))
+            if conflicts:
+                return [], conflicts
+
+            cursor.executemany('INSERT INTO bookings (player_id, session_id) VALUES (?, ?)',
+                               [(player_id, session_id) for session_id in session_ids])
+            return session_ids, []
+
+    def generate_sessions(self, dates, slots):
+        """Create every court x slot session for `dates` that does not exist yet.
+
+        `slots` holds (start, end) pairs as 'HH:MM' strings or minutes. Runs as a single executemany
+        transaction and returns the number of sessions created.
+        """
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id FROM courts')
+            court_ids = [row[0] for row in cursor.fetchall()]
+            slots = [(to_minutes(start), to_minutes(end)) for start, end in slots]
+            cursor.executemany('''
+                INSERT INTO sessions (court_id, day, start_minute, end_minute)
+                SELECT ?1, ?2, ?3, ?4
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM sessions WHERE court_id = ?1 AND day = ?2 AND start_minute = ?3
+                )
+            ''', [(court_id, day, start, end)
+                  for day in map(to_day, dates) for start, end in slots for court_id in court_ids])
+            return cursor.rowcount
 
     def create_booking(self, player_id, session_id):
-        with self.get_connection() as conn:
+        # BEGIN IMMEDIATE serialises the capacity check and the insert across connections
+        with self.transaction() as conn:
             cursor = conn.cursor()
-            # Check if session is full
+            # Check if session is full using the trigger-maintained counter;
+            # outstanding waiting-list offers hold their places too.
+            # A player holds at most one place, or one waiting-list spot, per session
             cursor.execute('''
-                SELECT COUNT(*) FROM bookings 
-                WHERE session_id = ? AND status = 'booked'
-            ''', (session_id,))
-            
-            if cursor.fetchone()[0] >= 6:
+                SELECT booked_count + (
+                    SELECT COUNT(*) FROM bookings
+                    WHERE session_id = sessions.id AND status = 'pending_confirmation'
+                ), EXISTS (
+                    SELECT 1 FROM bookings
+                    WHERE player_id = ?1 AND session_id = sessions.id
+                      AND status IN ('booked', 'late', 'pending_confirmation')
+                ), EXISTS (
+                    SELECT 1 FROM waiting_list WHERE session_id = sessions.id AND player_id = ?1
+                )
+                FROM sessions WHERE id = ?2
+            ''', (player_id, session_id))
+
+            session = cursor.fetchone()
+            if session is None:
+                raise ValueError("Session not found")
+            if session[1]:
+                raise ValueError("Already booked")
+            if session[2]:
+                raise ValueError("Already on the waiting list")
+
+            if session[0] >= SESSION_CAPACITY:
                 # Add to waiting list
                 cursor.execute('''
                     SELECT MAX(position) FROM waiting_list WHERE session_id = ?
@@ -176,17 +1012,71 @@ class Database:
             conn.commit()
 
     def get_player_bookings(self, player_id):
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
+        return list(self.iter_player_bookings(player_id))
+
+    def iter_player_bookings(self, player_id, batch_size=100):
+        """Yield a player's bookings in date order, fetching batch_size rows at a time"""
+        cursor = self.get_connection().cursor()
+        try:
+            # idx_bookings_player_day returns the rows in order, so the first batch needs no sort
             cursor.execute('''
-                SELECT c.court_number, s.date, s.start_time, s.end_time, b.status
+                SELECT c.court_number, b.day, b.start_minute, s.end_minute, b.status
                 FROM bookings b
                 JOIN sessions s ON b.session_id = s.id
                 JOIN courts c ON s.court_id = c.id
                 WHERE b.player_id = ?
-                ORDER BY s.date, s.start_time
+                ORDER BY b.day, b.start_minute
             ''', (player_id,))
-            return cursor.fetchall()
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for court, day, start, end, status in rows:
+                    yield court, from_day(day).isoformat(), format_minutes(start), format_minutes(end), status
+        finally:
+            cursor.close()
+
+    def check_occupancy_counters(self, repair=False):
+        """Compare sessions.booked_count/waiting_count with the base tables.
+
+        Returns (session_id, booked_count, actual_booked, waiting_count,
+        actual_waiting) for every drifted session, fixing them if `repair`.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT s.id, s.booked_count, COALESCE(b.booked, 0),
+                       s.waiting_count, COALESCE(w.waiting, 0)
+                FROM sessions s
+                LEFT JOIN (
+                    SELECT session_id, COUNT(*) AS booked FROM bookings
+                    WHERE status IN (?, ?) GROUP BY session_id
+                ) b ON b.session_id = s.id
+                LEFT JOIN (
+                    SELECT session_id, COUNT(*) AS waiting FROM waiting_list GROUP BY session_id
+                ) w ON w.session_id = s.id
+                WHERE s.booked_count != COALESCE(b.booked, 0)
+                   OR s.waiting_count != COALESCE(w.waiting, 0)
+            ''', BOOKED_STATUSES)
+            drift = cursor.fetchall()
+
+            if repair and drift:
+                cursor.executemany(
+                    'UPDATE sessions SET booked_count = ?, waiting_count = ? WHERE id = ?',
+                    [(booked, waiting, session_id) for session_id, _, booked, _, waiting in drift]
+                )
+            return drift
+
+    def prune_booking_events(self, keep=EVENT_RETENTION):
+        """Drop all but the newest `keep` change-feed events; returns how many went"""
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                DELETE FROM booking_events
+                WHERE id <= (SELECT MAX(id) FROM booking_events) - ?
+            ''', (keep,))
+            return cursor.rowcount
+
 
     def delete_player_by_email(self, email):
         """Delete a player record by email"""
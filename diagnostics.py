@@ -0,0 +1,424 @@
+import contextlib
+import io
+import os
+import re
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from unittest import mock
+
+from database import Database
+
+# Fixed-size reference tables that are fine to scan
+SMALL_TABLES = {'courts'}
+
+# MIN(id)/MAX(id) read one end of the rowid b-tree but plan as a bare SEARCH
+ROWID_EXTREME = re.compile(r'\b(?:MIN|MAX)\((?:\w+\.)?id\)', re.I)
+
+# Common table expressions are row sets built by the statement itself, e.g. from VALUES
+CTE_NAME = re.compile(r'\bWITH\s+(\w+)\s*\(', re.I)
+
+# Statements (matched by a fragment) whose plan must start with a seek on a given index,
+# because their cost has to stay independent of how much history the tables hold
+REQUIRED_PLANS = {
+    'AS is_no_show': 'SEARCH s USING COVERING INDEX idx_sessions_day',
+    '(b.day, b.start_minute, b.id) >': 'SEARCH b USING INDEX idx_bookings_player_day',
+    'SELECT c.court_number, b.day': 'SEARCH b USING INDEX idx_bookings_player_day',
+}
+
+SQL_KEYWORDS = {'ON', 'WHERE', 'JOIN', 'LEFT', 'INNER', 'CROSS', 'GROUP', 'ORDER', 'LIMIT', 'SET', 'AS'}
+
+
+def _table_aliases(sql):
+    """Map every table name and alias in a statement to its table name"""
+    aliases = {}
+    for table, alias in re.findall(r'(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', sql, re.I):
+        aliases[table] = table
+        if alias and alias.upper() not in SQL_KEYWORDS:
+            aliases[alias] = table
+    return aliases
+
+
+def find_table_scans(conn, sql):
+    """Return the EXPLAIN QUERY PLAN lines that scan a non-trivial table"""
+    aliases = _table_aliases(sql)
+    small = SMALL_TABLES | set(CTE_NAME.findall(sql))
+    problems = []
+    for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}'):
+        detail = row[-1]
+        # A SEARCH that names no index is a scan in disguise
+        match = re.match(r'SCAN (\w+)', detail) or (not ROWID_EXTREME.search(sql)
+                                                     and re.match(r'SEARCH (\w+)$', detail))
+        # Subqueries and constant rows have no alias and are skipped
+        if match and aliases.get(match.group(1), 'courts') not in small:
+            problems.append(detail)
+    return problems
+
+
+def _run_workload(db):
+    """Drive every SQL path in the CLI modules against a scratch database"""
+    from AttendanceSweeper import AttendanceSweeper
+    from EmailOutbox import EmailOutbox
+    from BookingSystem import BookingSystem
+    from NotificationSystem import NotificationSystem
+    from SessionGenerator import SessionGenerator
+    from UserInterface import UserInterface
+
+    booking_system = BookingSystem(db)
+    notifications = NotificationSystem(db=db)
+    ui = UserInterface(db)
+
+    SessionGenerator(db).run_once()
+    SessionGenerator(db).run_once(full=True)
+    players = [db.add_player(f"Player {i}", f"player{i}@example.com", "secret1") for i in range(8)]
+    day = (datetime.now() + timedelta(days=1)).date()
+    start_time = datetime.strptime('07:00', '%H:%M').time()
+    for player_id in players:
+        booking_system.book_session(player_id, 1, day, start_time)
+    # book_session() books on the admission queue's thread; trace the same SQL on this one
+    with booking_system.repository.unit_of_work() as uow:
+        uow.book(players[0], 2, day, start_time)
+    # A two-session block on two courts, then the same again, which conflicts everywhere
+    booking_system.book_series(players[1], [3, 4], day, datetime.strptime('11:00', '%H:%M').time(), slots=2)
+    booking_system.book_series(players[1], [3, 4], day, datetime.strptime('11:00', '%H:%M').time(), slots=2)
+    db.get_available_sessions(day.isoformat())
+    schedule = booking_system.schedule
+    schedule.load()
+    session_id = schedule.available(day)[0][0]
+    schedule.roster(session_id)
+    schedule.waitlist(session_id)
+
+    repository = booking_system.repository
+    repository.find_account('player0@example.com')
+    repository.account(players[0])
+    repository.standing(players[0])
+    repository.player_bookings_page(players[0], (day, '07:00', 0))
+    repository.free_slots(1, day)
+    repository.free_slots(1, day + timedelta(days=30))  # Outside the window, read from the tables
+    with repository.unit_of_work() as uow:
+        uow.set_password(players[0], "secret1")
+        uow.cancel(schedule.roster(session_id)[0].booking_id, schedule.roster(session_id)[0].player.player_id)
+    db.get_player_bookings(players[0])
+    db.update_player_status(players[0], warnings=1, fines=25)
+    feed = repository.events
+    feed.since(0)
+    feed.deltas(0, feed.last_id())
+    db.prune_booking_events()
+
+    session_start = datetime.combine(day, start_time)
+    notifications.notify_sweep(booking_system.check_late_arrivals(session_start + timedelta(minutes=20)))
+    notifications.notify_sweep(booking_system.check_late_arrivals(session_start + timedelta(minutes=40)))
+    sweeper = AttendanceSweeper(booking_system, notifications,
+                                clock=lambda: session_start + timedelta(minutes=50))
+    sweeper.run_once()
+    sweeper.run_once()
+
+    # No-shows at 09:00 free places for the two wait-listed players
+    later_start = datetime.combine(day, datetime.strptime('09:00', '%H:%M').time())
+    for player_id in players:
+        booking_system.book_session(player_id, 1, day, later_start.time())
+    booking_system.check_late_arrivals(later_start + timedelta(minutes=40))
+    engine = booking_system.waiting_list
+    engine.recover()
+    offers = engine.pending_offers(players[6], later_start + timedelta(minutes=41))
+    engine.confirm(offers[0][0], players[6], later_start + timedelta(minutes=42))
+    offers = engine.pending_offers(players[7], later_start + timedelta(minutes=41))
+    engine.decline(offers[0][0], players[7], later_start + timedelta(minutes=42))
+    engine.run_once(later_start + timedelta(hours=1))
+
+    session_info = {'court': 1, 'date': day, 'start_time': '07:00', 'end_time': '09:00'}
+    notifications.notify_booking_confirmation(players[0], session_info)
+    notifications.notify_late_warning(players[0])
+    notifications.notify_fine(players[0], "No-show")
+    notifications.notify_waiting_list_spot(players[0], session_info)
+
+    outbox = EmailOutbox({'sender': 'gym@example.com'}, db)
+    outbox.enqueue('player0@example.com', "Subject", "Body")
+    outbox.enqueue_many([('player1@example.com', "Subject", "Body")] * 2)
+    claimed = outbox.claim()
+    outbox._record([claimed[0][0]], [(row[0], row[4], "refused") for row in claimed[1:]])
+    outbox.recover()
+
+    ui.current_user = {'id': players[0], 'name': 'Player 0', 'email': 'player0@example.com'}
+    ui.display_time_slots(day.isoformat())
+    ui.view_my_bookings()
+    ui.view_warnings_and_fines()
+    with mock.patch('builtins.input', side_effect=['1,2', '07:00', '21:00', '2', '3']):
+        ui.find_earliest_slots()
+    with mock.patch('builtins.input', side_effect=['5', day.isoformat(), '19:00', '2']):
+        ui.book_series()
+    with mock.patch('builtins.input', side_effect=['player0@example.com', 'secret1']):
+        ui.login()
+    with mock.patch('builtins.input', side_effect=['Someone', 'player1@example.com', '2',
+                                                   'new@example.com', 'secret1']):
+        ui.register_user()
+    db.delete_player_by_email('new@example.com')
+
+
+def check_query_plans():
+    """Run the workload, EXPLAIN every statement it issued and report table scans or lost seeks"""
+    statements = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "plans.db"))
+        conn = db.get_connection()
+        conn.set_trace_callback(statements.append)
+        with contextlib.redirect_stdout(io.StringIO()):
+            _run_workload(db)
+        conn.set_trace_callback(None)
+
+        # The workload should also leave the trigger-maintained counters exact
+        drift = db.check_occupancy_counters()
+        assert not drift, f"occupancy counters drifted: {drift}"
+        stale = conn.execute('''
+            SELECT COUNT(*) FROM bookings b JOIN sessions s ON s.id = b.session_id
+            WHERE b.day IS NOT s.day OR b.start_minute IS NOT s.start_minute
+        ''').fetchone()[0]
+        assert not stale, f"{stale} bookings disagree with their session's day or start"
+
+        failures = {}
+        for sql in dict.fromkeys(statements):
+            if not re.match(r'\s*(SELECT|UPDATE|DELETE|INSERT|WITH)', sql, re.I):
+                continue
+            problems = find_table_scans(conn, sql)
+            for fragment, seek in REQUIRED_PLANS.items():
+                if fragment in sql:
+                    plan = [row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+                    if not plan[0].startswith(seek):
+                        problems.append(f"expected {seek}, planned {plan[0]}")
+                    problems.extend(line for line in plan if 'TEMP B-TREE' in line)
+            if problems:
+                failures[' '.join(sql.split())] = problems
+        db.close()
+    return failures
+
+
+def check_schedule_model(rounds=300, seed=0):
+    """Randomized differential check of ScheduleModel against the tables, with outside writers"""
+    import random
+    import sqlite3
+    from repository import ACTIVE_STATUSES, ScheduleModel
+    from SessionGenerator import SessionGenerator
+    from timecodes import from_day
+
+    rng = random.Random(seed)
+    mismatches = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "model.db")
+        db = Database(db_file)
+        SessionGenerator(db).run_once()
+        players = [db.add_player(f"Player {i}", f"player{i}@example.com", "secret1") for i in range(12)]
+        model = ScheduleModel(db)
+        model.load()
+        slots = list(model._slots)
+        # A separate connection stands in for another process writing to the same file
+        other = sqlite3.connect(db_file, isolation_level=None)
+
+        for step in range(rounds):
+            court_id, day, start = rng.choice(slots[:20])
+            action = rng.random()
+            if action < 0.5:
+                try:
+                    model.book(rng.choice(players), court_id, from_day(day), start)
+                except ValueError:
+                    pass  # The player already holds a place or spot there, and the model must not change
+            elif action < 0.6:
+                # All or nothing: either both sessions gain the player or neither does
+                occurrences = [(c, from_day(d), s) for c, d, s in rng.sample(slots[:20], 2)]
+                model.book_series(rng.choice(players), occurrences)
+            elif action < 0.8:
+                other.execute("UPDATE bookings SET status = ? WHERE id = (SELECT MAX(id) FROM bookings)",
+                              (rng.choice(('late', 'no_show', 'booked')),))
+            elif action < 0.9:
+                other.execute('DELETE FROM waiting_list WHERE id = (SELECT MIN(id) FROM waiting_list)')
+            else:
+                other.execute('UPDATE players SET fines = fines + 25 WHERE id = ?', (rng.choice(players),))
+
+            session_id = model._slots[(court_id, day, start)].session_id
+            roster = [(b.booking_id, b.status) for b in model.roster(session_id)]
+            waitlist = [p.player_id for p in model.waitlist(session_id)]
+            fines = {p.player_id: p.fines for p in model.players.values()}
+            available = model.available(from_day(day))
+            with db.get_connection() as conn:
+                expected_roster = conn.execute(f'''
+                    SELECT id, status FROM bookings
+                    WHERE session_id = ? AND status IN ({','.join('?' * len(ACTIVE_STATUSES))}) ORDER BY id
+                ''', (session_id,) + ACTIVE_STATUSES).fetchall()
+                expected_waitlist = [row[0] for row in conn.execute(
+                    'SELECT player_id FROM waiting_list WHERE session_id = ? ORDER BY position', (session_id,))]
+                expected_fines = dict(conn.execute(
+                    f"SELECT id, fines FROM players WHERE id IN ({','.join('?' * len(fines))})", list(fines)))
+            if roster != expected_roster or waitlist != expected_waitlist or fines != expected_fines:
+                mismatches.append((step, session_id, 'roster, waiting list or player differs'))
+            if available != db.get_available_sessions(from_day(day)):
+                mismatches.append((step, from_day(day), 'availability differs'))
+        # Late bookings keep their place, so the triggers must still count them after status changes
+        if db.check_occupancy_counters():
+            mismatches.append((rounds, None, 'booked_count or waiting_count drifted'))
+        other.close()
+        db.close()
+    return mismatches
+
+def check_change_feed(rounds=300, seed=0):
+    """Replaying the change feed from any event id must reproduce the sessions' counters"""
+    import random
+    import sqlite3
+    from changefeed import ChangeFeed
+    from repository import ScheduleModel
+    from SessionGenerator import SessionGenerator
+    from timecodes import format_minutes, from_day
+
+    rng = random.Random(seed)
+    mismatches = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "feed.db")
+        db = Database(db_file)
+        SessionGenerator(db).run_once()
+        players = [db.add_player(f"Player {i}", f"player{i}@example.com", "secret1") for i in range(12)]
+        model = ScheduleModel(db)
+        model.load()
+        slots = list(model._slots)[:10]
+        feed, unpolled = ChangeFeed(db), ChangeFeed(db)
+        other = sqlite3.connect(db_file, isolation_level=None)
+        checkpoints = [0]
+        position = 0
+        seen = {}
+
+        for step in range(rounds):
+            court_id, day, start = rng.choice(slots)
+            action = rng.random()
+            if action < 0.6:
+                try:
+                    model.book(rng.choice(players), court_id, from_day(day), start)
+                except ValueError:
+                    pass  # Already booked or waiting there
+            elif action < 0.8:
+                other.execute("UPDATE bookings SET status = ? WHERE id = (SELECT MAX(id) FROM bookings)",
+                              (rng.choice(('late', 'no_show', 'booked')),))
+            else:
+                other.execute('DELETE FROM bookings WHERE id = (SELECT MIN(id) FROM bookings)')
+            checkpoints.append(feed.last_id())
+            # Every seventh step reads the poller's buffer, the others the SQL fallback
+            if step % 7 == 0:
+                feed.poll()
+                head, deltas = feed.since(position)
+            else:
+                head, deltas = unpolled.since(position)
+            position = head
+            for delta in deltas or ():
+                seen[(delta['date'], delta['court'], delta['start'])] = (delta['booked'], delta['waiting'])
+            with db.get_connection() as conn:
+                expected = {(str(from_day(d)), court, format_minutes(s)): (booked, waiting)
+                            for d, court, s, booked, waiting in conn.execute('''
+                                SELECT s.day, c.court_number, s.start_minute, s.booked_count, s.waiting_count
+                                FROM sessions s JOIN courts c ON c.id = s.court_id
+                                WHERE s.booked_count > 0 OR s.waiting_count > 0
+                            ''')}
+            if deltas is None or {key: value for key, value in seen.items() if value != (0, 0)} != expected:
+                mismatches.append((step, 'feed replay differs from the sessions table'))
+
+        # Resuming from an older id covers every session touched since
+        after = rng.choice(checkpoints)
+        head, deltas = unpolled.since(after)
+        with db.get_connection() as conn:
+            touched = {row[0] for row in conn.execute(
+                'SELECT DISTINCT session_id FROM booking_events WHERE id > ?', (after,))}
+        if deltas is None or len(deltas) != len(touched):
+            mismatches.append((after, 'resume missed sessions'))
+        db.prune_booking_events(keep=1)
+        if unpolled.since(0)[1] is not None:
+            mismatches.append((0, 'pruned events did not reset the client'))
+        other.close()
+        db.close()
+    return mismatches
+
+def check_web_entry_point(timeout=60):
+    """Run `python app.py` on a scratch database and register through it; returns the problems found.
+
+    Password hashing workers re-import the main script, so this catches
+    start-up work that app.py would repeat in each of them.
+    """
+    import signal
+    import socket
+    import subprocess
+    import time
+    import urllib.error
+    import urllib.parse
+    import urllib.request
+
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    base = f"http://127.0.0.1:{port}"
+    problems = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "web.db")
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_file}", PORT=str(port))
+        server = subprocess.Popen([sys.executable, 'app.py'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                  start_new_session=True)
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    urllib.request.urlopen(base + '/', timeout=5)
+                    break
+                except (urllib.error.URLError, ConnectionError):
+                    if time.monotonic() > deadline or server.poll() is not None:
+                        problems.append("app.py did not start serving")
+                        return problems
+                    time.sleep(0.2)
+
+            form = urllib.parse.urlencode({'username': 'entry', 'email': 'entry@example.com',
+                                           'password': 'secret1'}).encode()
+            try:
+                urllib.request.urlopen(base + '/register', data=form, timeout=timeout)
+            except urllib.error.HTTPError as e:
+                problems.append(f"POST /register returned {e.code}")
+            if not Database(db_file).check_email_exists('entry@example.com'):
+                problems.append("registration through app.py did not create the player")
+        finally:
+            os.killpg(server.pid, signal.SIGTERM)
+            server.wait(timeout)
+    return problems
+
+
+def check_occupancy(db_file, repair=False):
+    """Report sessions whose booked/waiting counters disagree with the base tables"""
+    drift = Database(db_file).check_occupancy_counters(repair=repair)
+    for session_id, booked_count, booked, waiting_count, waiting in drift:
+        print(f"Session {session_id}: booked_count {booked_count} (actual {booked}), "
+              f"waiting_count {waiting_count} (actual {waiting})")
+    return drift
+
+
+if __name__ == "__main__":
+    # Usage: python diagnostics.py [database file [--repair]]
+    if len(sys.argv) > 1:
+        drift = check_occupancy(sys.argv[1], repair='--repair' in sys.argv)
+        if drift and '--repair' not in sys.argv:
+            sys.exit(1)
+        print("Occupancy counters OK" if not drift else f"Repaired {len(drift)} sessions")
+        sys.exit(0)
+
+    failures = check_query_plans()
+    for sql, problems in failures.items():
+        print(f"{sql}\n    -> {'; '.join(problems)}")
+
+    model_mismatches = check_schedule_model()
+    for mismatch in model_mismatches:
+        print(f"Schedule model mismatch: {mismatch}")
+
+    feed_mismatches = check_change_feed()
+    for mismatch in feed_mismatches:
+        print(f"Change feed mismatch: {mismatch}")
+
+    entry_problems = check_web_entry_point()
+    for problem in entry_problems:
+        print(f"Web entry point: {problem}")
+
+    if failures or model_mismatches or feed_mismatches or entry_problems:
+        sys.exit(1)
+    print("Query plans OK: no table scans on hot queries")
+    print("Schedule model OK: matches the database across writers")
+    print("Change feed OK: replays match the database from any event id")
+    print("Web entry point OK: python app.py registers players")
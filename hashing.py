@@ -0,0 +1,90 @@
+import hmac
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Werkzeug method string; raise the iteration count as hardware gets faster
+DEFAULT_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+DEFAULT_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1)))
+
+HASH_PREFIXES = ('pbkdf2:', 'scrypt:')
+
+# Workers start from a clean process, not a fork of this threaded one and its open connections
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+def _hash(password, method, salt_length):
+    return generate_password_hash(password, method=method, salt_length=salt_length)
+
+
+def _verify(stored, password):
+    return check_password_hash(stored, password)
+
+
+def is_hashed(stored):
+    """False for legacy rows that still hold a plaintext password"""
+    return stored.startswith(HASH_PREFIXES)
+
+
+class PasswordHasher:
+    """Runs password hashing on a bounded process pool, off the request thread"""
+
+    def __init__(self, method=DEFAULT_METHOD, salt_length=16, workers=DEFAULT_WORKERS, max_pending=None):
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        # Callers beyond this many in-flight hashes wait instead of growing the queue
+        self._slots = threading.BoundedSemaphore(max_pending or workers * 4)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                context = multiprocessing.get_context(START_METHOD)
+                if START_METHOD == 'forkserver':
+                    # Workers fork from a server that has loaded this module, not the app that started it
+                    context.set_forkserver_preload(['hashing'])
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._executor
+
+    def _run(self, func, *args):
+        with self._slots:
+            return self.executor.submit(func, *args).result()
+
+    def hash(self, password):
+        return self._run(_hash, password, self.method, self.salt_length)
+
+    def needs_rehash(self, stored):
+        """True when a stored value is plaintext or uses other cost parameters"""
+        return not is_hashed(stored) or stored.split('$', 1)[0] != self.method
+
+    def verify(self, stored, password):
+        """Check a password, returning (ok, new_hash).
+
+        new_hash is set when the password matched but the stored value is
+        plaintext or outdated and should be replaced.
+        """
+        if not stored:
+            return False, None
+        if is_hashed(stored):
+            ok = self._run(_verify, stored, password)
+        else:
+            ok = hmac.compare_digest(stored.encode(), password.encode())
+
+        if ok and self.needs_rehash(stored):
+            return True, self.hash(password)
+        return ok, None
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+# Shared by the Flask app and the CLI
+hasher = PasswordHasher()
@@ -0,0 +1,152 @@
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+# Upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Statements at least this slow are written to the slow-query log
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+
+# Distinct statement labels tracked before the rest are grouped as 'other'
+MAX_STATEMENTS = 500
+
+# Raw SQL strings whose labels are remembered; others are normalized on every call
+MAX_CACHED_SQL = 5000
+
+slow_query_log = logging.getLogger('slow_queries')
+
+_IN_LIST = re.compile(r'IN \(\s*\?(?:\s*,\s*\?)*\s*\)', re.I)
+_VALUES_LIST = re.compile(r'VALUES\s*(\(\s*\?(?:\s*,\s*\?)*\s*\))(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))+', re.I)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus layout"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in pairs)
+
+
+class Metrics:
+    """Process-wide query, lock-wait, connection and request measurements"""
+
+    def __init__(self, slow_query_ms=SLOW_QUERY_MS):
+        self.slow_query_ms = slow_query_ms
+        self.slow_queries = deque(maxlen=100)  # (unix time, source, ms, statement)
+        self._histograms = {}  # (metric, label pairs) -> Histogram
+        self._counters = {}  # (metric, label pairs) -> value
+        self._gauges = {}  # (metric, label pairs) -> value
+        self._statements = {}  # raw SQL -> statement label
+        self._labels = set()  # distinct statement labels handed out
+        self._lock = threading.Lock()
+
+    def statement(self, sql):
+        """Short, parameter-free label for a SQL string; IN and VALUES lists of any length share one"""
+        label = self._statements.get(sql)
+        if label is None:
+            label = _VALUES_LIST.sub(r'VALUES \1', _IN_LIST.sub('IN (?)', ' '.join(sql.split())))[:200]
+            # Cap the labels, not the raw strings, so list lengths cannot crowd out other statements
+            if label not in self._labels:
+                if len(self._labels) >= MAX_STATEMENTS:
+                    label = 'other'
+                else:
+                    self._labels.add(label)
+            if len(self._statements) < MAX_CACHED_SQL:
+                self._statements[sql] = label
+        return label
+
+    def _observe(self, metric, labels, seconds):
+        key = (metric, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def observe_query(self, source, sql, seconds):
+        label = self.statement(sql)
+        self._observe('db_query_duration_seconds', (('source', source), ('statement', label)), seconds)
+        if seconds * 1000 >= self.slow_query_ms:
+            self.slow_queries.append((time.time(), source, seconds * 1000, label))
+            slow_query_log.warning("slow query (%s, %.1f ms): %s", source, seconds * 1000, label)
+
+    def observe_lock_wait(self, source, seconds):
+        self._observe('db_lock_wait_seconds', (('source', source),), seconds)
+
+    def observe_queue_wait(self, queue, seconds):
+        self._observe('queue_wait_seconds', (('queue', queue),), seconds)
+
+    def observe_request(self, method, route, status, seconds):
+        self._observe('http_request_duration_seconds',
+                      (('method', method), ('route', route), ('status', status)), seconds)
+
+    def inc(self, metric, value=1, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def add_gauge(self, metric, delta, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + delta
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._gauges.clear()
+            self.slow_queries.clear()
+
+    def render(self):
+        """Everything recorded so far in the Prometheus text exposition format"""
+        with self._lock:
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            snapshots = [(key, list(h.counts), h.sum, h.count) for key, h in histograms]
+
+        lines, typed = [], set()
+        for (metric, labels), value in counters:
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} counter')
+                typed.add(metric)
+            lines.append(f'{metric}{{{_labels(labels)}}} {value}')
+        for (metric, labels), value in gauges:
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} gauge')
+                typed.add(metric)
+            lines.append(f'{metric}{{{_labels(labels)}}} {value}')
+        for (metric, labels), counts, total, count in snapshots:
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} histogram')
+                typed.add(metric)
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{metric}_bucket{{{_labels(labels + (("le", bound),))}}} {cumulative}')
+            lines.append(f'{metric}_sum{{{_labels(labels)}}} {total}')
+            lines.append(f'{metric}_count{{{_labels(labels)}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+# Shared by the Flask app and the CLI
+metrics = Metrics()
@@ -0,0 +1,499 @@
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from admission import AdmissionQueue
+from cache import TTLCache
+from changefeed import ChangeFeed
+from database import BOOKED_STATUSES, Database
+from schedule import BOOKING_WINDOW_DAYS, WeekOccupancy, build_day_grid, check_booking_window
+from timecodes import format_minutes, from_day, to_day, to_minutes
+from WaitingListEngine import WaitingListEngine
+
+# Booking statuses that hold a place in a session
+ACTIVE_STATUSES = BOOKED_STATUSES + ('pending_confirmation',)
+
+VERSION_QUERY = 'SELECT version FROM schedule_version WHERE id = 1'
+
+
+class Court:
+    __slots__ = ('court_id', 'court_number', 'sessions')
+
+    def __init__(self, court_id, court_number=None):
+        self.court_id = court_id
+        self.court_number = court_id if court_number is None else court_number
+        self.sessions = []  # List of sessions for this court
+
+    def add_session(self, session):
+        self.sessions.append(session)
+
+
+class Session:
+    __slots__ = ('session_id', 'court', 'day', 'start_minute', 'end_minute', 'bookings', 'waiting_list')
+
+    def __init__(self, session_id, court, day, start_minute, end_minute):
+        self.session_id = session_id
+        self.court = court
+        self.day = day
+        self.start_minute = start_minute
+        self.end_minute = end_minute
+        self.bookings = []  # Bookings holding a place (booked, late or offered)
+        self.waiting_list = []  # Players in waiting-list order
+
+    @property
+    def date(self):
+        return from_day(self.day)
+
+    @property
+    def start_time(self):
+        return format_minutes(self.start_minute)
+
+    @property
+    def end_time(self):
+        return format_minutes(self.end_minute)
+
+    @property
+    def booked_count(self):
+        return sum(booking.status in BOOKED_STATUSES for booking in self.bookings)
+
+    def book_player(self, player, booking_id, status='booked'):
+        booking = Booking(booking_id, player, self, status)
+        self.bookings.append(booking)
+        return booking
+
+    def wait_player(self, player):
+        self.waiting_list.append(player)
+
+
+class Player:
+    __slots__ = ('player_id', 'name', 'warnings', 'fines')
+
+    def __init__(self, player_id, name, warnings=0, fines=0):
+        self.player_id = player_id
+        self.name = name
+        self.warnings = warnings
+        self.fines = fines
+
+    def add_warning(self):
+        self.warnings += 1
+        if self.warnings >= 3:
+            self.fines += 25
+
+    def add_no_show_fine(self):
+        self.fines += 25
+
+
+class Booking:
+    __slots__ = ('booking_id', 'player', 'session', 'status')
+
+    def __init__(self, booking_id, player, session, status='booked'):
+        self.booking_id = booking_id
+        self.player = player
+        self.session = session
+        self.status = status  # Other statuses can be 'late', 'no_show', 'pending_confirmation'
+
+    @property
+    def court(self):
+        return self.session.court
+
+    def mark_late(self):
+        self.status = 'late'
+        self.player.add_warning()
+
+    def mark_no_show(self):
+        self.status = 'no_show'
+        self.player.add_no_show_fine()
+
+
+class ScheduleModel:
+    """Courts, sessions, rosters and waiting lists for the booking window, held in memory.
+
+    Everything from today to the end of the booking window is loaded with a
+    handful of bulk queries and then serves availability, roster and
+    waiting-list reads without touching the tables. Bookings made through
+    book() write through to the database and are applied in place; any
+    other change, from this process or another, moves the trigger-maintained
+    schedule_version counter and the next read reloads.
+    """
+
+    def __init__(self, db, days=BOOKING_WINDOW_DAYS, clock=datetime.now):
+        self.db = db
+        self.days = days
+        self.clock = clock
+        self.courts = {}  # court_id -> Court
+        self.sessions = {}  # session_id -> Session
+        self.players = {}  # player_id -> Player
+        self._slots = {}  # (court_id, day, start_minute) -> Session
+        self._by_day = {}  # day -> sessions in (start, court number) order
+        self._first_day = None
+        self._version = None  # schedule_version the model reflects; None forces a reload
+        self._lock = threading.RLock()
+
+    def load(self, today=None):
+        """Read the whole booking window in bulk, replacing whatever was held"""
+        with self._lock:
+            first = to_day(today or self.clock())
+            last = first + self.days
+            # One snapshot, so the counter and the rows describe the same moment
+            with self.db.snapshot() as conn:
+                cursor = conn.cursor()
+                cursor.execute(VERSION_QUERY)
+                version = cursor.fetchone()[0]
+                cursor.execute('SELECT id, court_number FROM courts')
+                courts = {court_id: Court(court_id, number) for court_id, number in cursor.fetchall()}
+
+                cursor.execute('''
+                    SELECT id, court_id, day, start_minute, end_minute FROM sessions
+                    WHERE day BETWEEN ? AND ?
+                ''', (first, last))
+                sessions = {}
+                for session_id, court_id, day, start, end in cursor.fetchall():
+                    court = courts.get(court_id) or courts.setdefault(court_id, Court(court_id))
+                    session = sessions[session_id] = Session(session_id, court, day, start, end)
+                    court.add_session(session)
+
+                cursor.execute(f'''
+                    SELECT id, name, warnings, fines FROM players
+                    WHERE id IN (
+                        SELECT b.player_id FROM sessions s JOIN bookings b ON b.session_id = s.id
+                        WHERE s.day BETWEEN ?1 AND ?2 AND b.status IN ({','.join('?' * len(ACTIVE_STATUSES))})
+                        UNION
+                        SELECT w.player_id FROM sessions s JOIN waiting_list w ON w.session_id = s.id
+                        WHERE s.day BETWEEN ?1 AND ?2
+                    )
+                ''', (first, last) + ACTIVE_STATUSES)
+                players = {row[0]: Player(*row) for row in cursor.fetchall()}
+
+                cursor.execute(f'''
+                    SELECT b.id, b.player_id, b.session_id, b.status
+                    FROM sessions s JOIN bookings b ON b.session_id = s.id
+                    WHERE s.day BETWEEN ?1 AND ?2 AND b.status IN ({','.join('?' * len(ACTIVE_STATUSES))})
+                    ORDER BY b.id
+                ''', (first, last) + ACTIVE_STATUSES)
+                for booking_id, player_id, session_id, status in cursor.fetchall():
+                    sessions[session_id].book_player(players[player_id], booking_id, status)
+
+                cursor.execute('''
+                    SELECT w.player_id, w.session_id
+                    FROM sessions s JOIN waiting_list w ON w.session_id = s.id
+                    WHERE s.day BETWEEN ? AND ?
+                    ORDER BY w.session_id, w.position
+                ''', (first, last))
+                for player_id, session_id in cursor.fetchall():
+                    sessions[session_id].wait_player(players[player_id])
+
+            by_day = {}
+            for session in sessions.values():
+                by_day.setdefault(session.day, []).append(session)
+            for day_sessions in by_day.values():
+                day_sessions.sort(key=lambda s: (s.start_minute, s.court.court_number))
+
+            self.courts, self.sessions, self.players, self._by_day = courts, sessions, players, by_day
+            self._slots = {(s.court.court_id, s.day, s.start_minute): s for s in sessions.values()}
+            self._first_day = first
+            self._version = version
+
+    def refresh(self):
+        """Reload when another writer has changed the schedule or the window has moved on.
+
+        Returns the schedule version the model now reflects.
+        """
+        with self._lock:
+            if self._version != self.db.schedule_version() or self._first_day != to_day(self.clock()):
+                self.load()
+            return self._version
+
+    def sessions_on(self, date):
+        """A date's sessions in (start, court number) order, or None outside the loaded window"""
+        day = to_day(date)
+        with self._lock:
+            self.refresh()
+            if not self._first_day <= day <= self._first_day + self.days:
+                return None
+            return list(self._by_day.get(day, []))
+
+    def available(self, date):
+        """(session_id, court, start, end, booked) for a date, as Database.get_available_sessions"""
+        sessions = self.sessions_on(date)
+        if sessions is None:
+            return self.db.get_available_sessions(date)
+        return [(s.session_id, s.court.court_number, s.start_time, s.end_time, s.booked_count) for s in sessions]
+
+    def _session(self, session_id):
+        self.refresh()
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise ValueError("Session not in the booking window")
+        return session
+
+    def roster(self, session_id):
+        """Bookings holding a place in a session, oldest first"""
+        with self._lock:
+            return list(self._session(session_id).bookings)
+
+    def waitlist(self, session_id):
+        """Players waiting for a session, front of the queue first"""
+        with self._lock:
+            return list(self._session(session_id).waiting_list)
+
+    def book(self, player_id, court_id, date, start_time):
+        """Book through the database, then apply the booking to the model in place"""
+        # Same lock order as the waiting-list engine: database write lock, then ours
+        with self.db.transaction() as conn, self._lock:
+            cursor = conn.cursor()
+            # Read through the cursor: a `with conn` block here would commit the transaction
+            cursor.execute(VERSION_QUERY)
+            before = cursor.fetchone()[0]
+            result = self.db.book_slot(player_id, court_id, date, start_time)
+            cursor.execute('SELECT last_insert_rowid()')
+            row_id = cursor.fetchone()[0]
+
+            session = self._slots.get((court_id, to_day(date), to_minutes(start_time)))
+            if before != self._version or session is None:
+                # Already stale, or outside what is loaded; the next read reloads
+                self._version = None
+                return result
+
+            player = self._player(cursor, player_id)
+            if result == "Booking successful":
+                session.book_player(player, row_id)
+            else:
+                session.wait_player(player)
+            cursor.execute(VERSION_QUERY)
+            self._version = cursor.fetchone()[0]
+        return result
+
+    def book_series(self, player_id, occurrences, earliest=None, latest=None):
+        """Book every occurrence through the database or none; applies them to the model in place"""
+        with self.db.transaction() as conn, self._lock:
+            cursor = conn.cursor()
+            cursor.execute(VERSION_QUERY)
+            before = cursor.fetchone()[0]
+            session_ids, conflicts = self.db.book_series(player_id, occurrences, earliest, latest)
+            if not session_ids:
+                return conflicts
+            # One transaction holds the write lock, so the executemany ids are consecutive
+            cursor.execute('SELECT last_insert_rowid()')
+            last_id = cursor.fetchone()[0]
+
+            sessions = [self.sessions.get(session_id) for session_id in session_ids]
+            if before != self._version or None in sessions:
+                self._version = None
+                return conflicts
+            player = self._player(cursor, player_id)
+            for booking_id, session in zip(range(last_id - len(sessions) + 1, last_id + 1), sessions):
+                session.book_player(player, booking_id)
+            cursor.execute(VERSION_QUERY)
+            self._version = cursor.fetchone()[0]
+        return conflicts
+
+    def _player(self, cursor, player_id):
+        player = self.players.get(player_id)
+        if player is None:
+            cursor.execute('SELECT name, warnings, fines FROM players WHERE id = ?', (player_id,))
+            player = self.players[player_id] = Player(player_id, *cursor.fetchone())
+        return player
+
+
+
+
+class UnitOfWork:
+    """The writes of one web request or CLI command, committed as a single transaction.
+
+    Statements run as they are issued, so results and capacity errors come
+    back straight away, but nothing is committed until the block completes,
+    and caches that a rollback could not undo are only updated after that.
+    """
+
+    def __init__(self, repository, conn):
+        self.repository = repository
+        self.db = repository.db
+        self.conn = conn
+        self._after_commit = []
+
+    def add_player(self, name, email, password_hash, username=None):
+        """Register a player; raises ValueError if the email or username is taken"""
+        if username is not None and self.repository.find_account(username):
+            raise ValueError("Username already exists")
+        return self.db.add_player(name, email, password_hash, username)
+
+    def set_password(self, player_id, password_hash):
+        cursor = self.conn.cursor()
+        cursor.execute('UPDATE players SET password = ? WHERE id = ?', (password_hash, player_id))
+        self._after_commit.append(lambda: self.repository.accounts.invalidate(player_id))
+
+    def book(self, player_id, court_id, date, start_time, now=None):
+        """Book a place in the booking window, or a waiting-list spot once the session is full"""
+        check_booking_window(date, start_time, now)
+        return self.repository.schedule.book(player_id, court_id, date, start_time)
+
+    def book_series(self, player_id, occurrences, now=None):
+        """Book every (court, date, start) occurrence in the booking window, or none of them.
+
+        Returns the conflicts as (court, date, 'HH:MM', reason); the series
+        was booked if there are none.
+        """
+        now = now or datetime.now()
+        return self.repository.schedule.book_series(player_id, occurrences, earliest=now,
+                                                    latest=now + timedelta(days=BOOKING_WINDOW_DAYS))
+
+    def cancel(self, booking_id, player_id):
+        """Give up a booking or offer and pass the place on; False if it is not the player's to cancel"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            DELETE FROM bookings
+            WHERE id = ? AND player_id = ? AND status IN ('booked', 'pending_confirmation')
+            RETURNING session_id
+        ''', (booking_id, player_id))
+        row = cursor.fetchone()
+        if row is None:
+            return False
+        self.repository.waiting_list.wheel.cancel(booking_id)
+        self.repository.waiting_list.promote([row[0]])
+        return True
+
+    def committed(self):
+        for callback in self._after_commit:
+            callback()
+        # Live clients hear about this request's changes without waiting for the next poll
+        self.repository.events.notify()
+
+
+class Repository:
+    """The single data-access layer over the booking database, for the web app and the CLI alike.
+
+    Reads are served from shared caches: the in-memory schedule model, the
+    week occupancy grids and a short-lived account cache. Writes go through
+    unit_of_work(), so the capacity check happens once, in the database,
+    inside the transaction that makes the booking. Contended bookings can
+    go through `admission`, which queues them per slot and commits each
+    slot's batch at once. `events` streams the resulting availability
+    changes to live clients.
+    """
+    _repositories = {}
+    _repositories_lock = threading.Lock()
+
+    def __init__(self, db=None):
+        self.db = db or Database()
+        self.schedule = ScheduleModel(self.db)
+        self.week = WeekOccupancy(self.db)
+        self.waiting_list = WaitingListEngine(self.db)
+        self.accounts = TTLCache(maxsize=1024, ttl=300)
+        self.events = ChangeFeed(self.db)
+        self.admission = AdmissionQueue(self)
+        self._court_ids = {}  # court_number -> courts.id
+
+    @classmethod
+    def for_database(cls, db):
+        """The process-wide repository for a database file, so every caller shares its caches"""
+        key = db.db_file if db.db_file == ':memory:' else os.path.abspath(db.db_file)
+        with cls._repositories_lock:
+            repository = cls._repositories.get(key)
+            if repository is None:
+                repository = cls._repositories[key] = cls(db)
+            return repository
+
+    @contextmanager
+    def unit_of_work(self):
+        """Yield a UnitOfWork whose writes commit together when the block exits cleanly"""
+        with self.db.transaction() as conn:
+            uow = UnitOfWork(self, conn)
+            yield uow
+        uow.committed()
+
+    def court_id(self, court_number):
+        """The courts row id for a court number; raises ValueError if there is no such court"""
+        court_id = self._court_ids.get(court_number)
+        if court_id is None:
+            with self.db.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT id FROM courts WHERE court_number = ?', (court_number,))
+                row = cursor.fetchone()
+            if row is None:
+                raise ValueError(f"There is no court {court_number}")
+            court_id = self._court_ids[court_number] = row[0]
+        return court_id
+
+    # Accounts
+
+    def account(self, player_id):
+        """(id, name, email, password hash, username) for a player, cached briefly"""
+        account = self.accounts.get(player_id)
+        if account is None:
+            with self.db.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT id, name, email, password, username FROM players WHERE id = ?',
+                               (player_id,))
+                account = cursor.fetchone()
+            if account is not None:
+                self.accounts.set(player_id, account)
+        return account
+
+    def find_account(self, login):
+        """The account whose username or email is `login`, or None"""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, name, email, password, username FROM players
+                WHERE username = ? OR email = ?
+                ORDER BY username = ? DESC
+                LIMIT 1
+            ''', (login, login, login))
+            return cursor.fetchone()
+
+    def standing(self, player_id):
+        """(warnings, fines) for a player"""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT warnings, fines FROM players WHERE id = ?', (player_id,))
+            return cursor.fetchone()
+
+    # Bookings
+
+    def player_bookings(self, player_id):
+        """Stream a player's bookings in date order, as Database.iter_player_bookings"""
+        return self.db.iter_player_bookings(player_id)
+
+    def player_bookings_page(self, player_id, after=None, limit=20):
+        """Up to `limit` of a player's bookings after a (date, 'HH:MM', booking id) key, in that order"""
+        after = (to_day(after[0]), to_minutes(after[1]), after[2]) if after else (0, 0, 0)
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT b.id, c.court_number, b.day, b.start_minute, s.end_minute, b.status
+                FROM bookings b
+                JOIN sessions s ON b.session_id = s.id
+                JOIN courts c ON s.court_id = c.id
+                WHERE b.player_id = ? AND (b.day, b.start_minute, b.id) > (?, ?, ?)
+                ORDER BY b.day, b.start_minute, b.id
+                LIMIT ?
+            ''', (player_id,) + after + (limit,))
+            return [{'id': booking_id, 'court_number': court, 'date': from_day(day).isoformat(),
+                     'start_time': format_minutes(start), 'end_time': format_minutes(end), 'status': status}
+                    for booking_id, court, day, start, end, status in cursor.fetchall()]
+
+    # Availability
+
+    def available(self, date):
+        return self.schedule.available(date)
+
+    def day_grid(self, date):
+        return build_day_grid(self.db, date)
+
+    def find_earliest_slots(self, *args, **kwargs):
+        return self.week.find_earliest_slots(*args, **kwargs)
+
+    def free_slots(self, court_number, date):
+        """(start, end) minute ranges on a court and date where a session still has room.
+
+        Read from the same day grids as the schedule; conflicts are decided by
+        the booking transaction, so no separate per-court slot index is kept.
+        """
+        offset = (date - datetime.now().date()).days
+        if 0 <= offset <= BOOKING_WINDOW_DAYS:
+            grid = self.week.grids(datetime.now().date())[offset]
+        else:
+            grid = build_day_grid(self.db, date)
+        if court_number not in grid.courts:
+            return []
+        return grid.free_ranges(grid.courts.index(court_number))
@@ -1,7 +1,29 @@
-from flask import render_template, request, redirect, url_for, flash
+from flask import render_template, request, redirect, url_for, flash, jsonify, g, Response
 from flask_login import login_user, login_required, logout_user, current_user
-from app import app, db, User, Booking
+from app import app, repository, User
+import json
 from datetime import datetime, time
+from time import perf_counter
+from hashing import hasher
+from metrics import metrics
+from schedule import MAX_SERIES_WEEKS, SLOT_MINUTES, series_slots
+from timecodes import format_minutes, to_minutes
+
+@app.before_request
+def start_request_timer():
+    g.request_started = perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    # Label by URL rule, not path, so /api/availability/<date_str> is one series
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.observe_request(request.method, route, response.status_code,
+                            perf_counter() - g.request_started)
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
@@ -14,18 +36,22 @@ def register():
         email = request.form['email']
         password = request.form['password']
         
-        if User.query.filter_by(username=username).first():
+        if repository.find_account(username):
             flash('Username already exists')
             return redirect(url_for('register'))
         
-        if User.query.filter_by(email=email).first():
+        if repository.find_account(email):
             flash('Email already registered')
             return redirect(url_for('register'))
         
-        user = User(username=username, email=email)
-        user.set_password(password)
-        db.session.add(user)
-        db.session.commit()
+        # Hash before the unit of work, which holds the database write lock until it ends
+        password_hash = hasher.hash(password)
+        try:
+            with repository.unit_of_work() as uow:
+                uow.add_player(username, email, password_hash, username=username)
+        except ValueError as e:
+            flash(str(e))
+            return redirect(url_for('register'))
         
         flash('Registration successful')
         return redirect(url_for('login'))
@@ -37,10 +63,15 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        user = User.query.filter_by(username=username).first()
+        account = repository.find_account(username)
+        ok, new_hash = hasher.verify(account[3], password) if account else (False, None)
         
-        if user and user.check_password(password):
-            login_user(user)
+        if ok:
+            if new_hash:
+                # Upgrade outdated hashes
+                with repository.unit_of_work() as uow:
+                    uow.set_password(account[0], new_hash)
+            login_user(User(*account))
             return redirect(url_for('dashboard'))
         else:
             flash('Invalid username or password')
@@ -53,11 +84,38 @@ def logout():
     logout_user()
     return redirect(url_for('index'))
 
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+# Bookings shown per dashboard page
+PAGE_SIZE = 20
+
+def parse_booking_cursor(value):
+    """Decode a 'YYYY-MM-DD_HH:MM_id' dashboard cursor, or None if absent or malformed"""
+    try:
+        date_str, time_str, booking_id = value.split('_')
+        return (datetime.strptime(date_str, '%Y-%m-%d').date(),
+                datetime.strptime(time_str, '%H:%M').time(),
+                int(booking_id))
+    except (AttributeError, ValueError):
+        return None
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    user_bookings = Booking.query.filter_by(user_id=current_user.id).all()
-    return render_template('dashboard.html', bookings=user_bookings)
+    # Keyset pagination: seek past the last row shown instead of using OFFSET
+    after = parse_booking_cursor(request.args.get('after'))
+    user_bookings = repository.player_bookings_page(current_user.id, after, PAGE_SIZE + 1)
+
+    next_cursor = None
+    if len(user_bookings) > PAGE_SIZE:
+        user_bookings = user_bookings[:PAGE_SIZE]
+        last = user_bookings[-1]
+        next_cursor = f"{last['date']}_{last['start_time']}_{last['id']}"
+    return render_template('dashboard.html', bookings=user_bookings, next_cursor=next_cursor)
 
 @app.route('/book', methods=['GET', 'POST'])
 @login_required
@@ -72,30 +130,144 @@ def book():
         start_time = datetime.strptime(start_time_str, '%H:%M').time()
         end_time = datetime.strptime(end_time_str, '%H:%M').time()
         
-        # Check for existing bookings
-        existing_booking = Booking.query.filter_by(
-            court_number=court_number,
-            date=date
-        ).filter(
-            ((Booking.start_time <= start_time) & (Booking.end_time > start_time)) |
-            ((Booking.start_time < end_time) & (Booking.end_time >= end_time))
-        ).first()
-        
-        if existing_booking:
-            flash('This court is already booked for the selected time')
+        if to_minutes(end_time) - to_minutes(start_time) != SLOT_MINUTES:
+            flash(f'Bookings cover one {SLOT_MINUTES}-minute session')
             return redirect(url_for('book'))
-        
-        booking = Booking(
-            court_number=court_number,
-            date=date,
-            start_time=start_time,
-            end_time=end_time,
-            user_id=current_user.id
-        )
-        
-        db.session.add(booking)
-        db.session.commit()
-        flash('Booking successful')
+
+        # Capacity is checked once, in the database, as the admission queue
+        # books this slot's pending requests in a single transaction
+        try:
+            court_id = repository.court_id(court_number)
+            result = repository.admission.book(current_user.id, court_id, date, start_time)
+        except ValueError as e:
+            flash(str(e))
+            return redirect(url_for('book'))
+        flash(result)
         return redirect(url_for('dashboard'))
     
-    return render_template('book.html')
+    date = parse_date(request.args.get('date')) or datetime.now().date()
+    return render_template('book.html', grid=repository.day_grid(date),
+                           today=datetime.now().date().isoformat(), max_series_weeks=MAX_SERIES_WEEKS)
+
+def book_series_from(values, courts):
+    """Book the series described by form or JSON values; returns (occurrences, conflicts)"""
+    numbers = {repository.court_id(int(court)): int(court) for court in courts}
+    occurrences = series_slots(
+        list(numbers),
+        datetime.strptime(values['date'], '%Y-%m-%d').date(),
+        datetime.strptime(values['start_time'], '%H:%M').time(),
+        slots=int(values.get('slots', 1)),
+        weeks=int(values.get('weeks', 1)),
+    )
+    with repository.unit_of_work() as uow:
+        conflicts = uow.book_series(current_user.id, occurrences)
+    # Report conflicts by court number, as the user chose them
+    return occurrences, [(numbers[court_id], date, start, reason) for court_id, date, start, reason in conflicts]
+
+@app.route('/book/series', methods=['POST'])
+@login_required
+def book_series():
+    try:
+        occurrences, conflicts = book_series_from(request.form, request.form.getlist('courts'))
+    except (KeyError, ValueError) as e:
+        flash(f'Invalid series: {str(e)}')
+        return redirect(url_for('book'))
+    if conflicts:
+        flash('Nothing was booked. Conflicts: ' + '; '.join(
+            f'Court {court} on {date} at {start}: {reason}' for court, date, start, reason in conflicts))
+        return redirect(url_for('book'))
+    flash(f'Booked {len(occurrences)} sessions')
+    return redirect(url_for('dashboard'))
+
+@app.route('/api/bookings/series', methods=['POST'])
+@login_required
+def api_book_series():
+    # e.g. {"courts": [1, 2], "date": "2024-05-06", "start_time": "19:00", "slots": 2, "weeks": 1}
+    values = request.get_json(silent=True) or {}
+    try:
+        occurrences, conflicts = book_series_from(values, values.get('courts') or [])
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid series: {str(e)}'}), 400
+    if conflicts:
+        return jsonify({'conflicts': [{'court': court, 'date': str(date), 'start_time': start, 'reason': reason}
+                                      for court, date, start, reason in conflicts]}), 409
+    return jsonify({'booked': len(occurrences)})
+
+@app.route('/cancel/<int:booking_id>', methods=['POST'])
+@login_required
+def cancel(booking_id):
+    with repository.unit_of_work() as uow:
+        cancelled = uow.cancel(booking_id, current_user.id)
+    if not cancelled:
+        flash('Booking not found')
+        return redirect(url_for('dashboard'))
+
+    flash('Booking cancelled')
+    return redirect(url_for('dashboard'))
+
+@app.route('/api/free-slots/<date_str>')
+def free_slots(date_str):
+    date = parse_date(date_str)
+    if date is None:
+        return jsonify({'error': 'Invalid date, expected YYYY-MM-DD'}), 400
+    courts = repository.day_grid(date).courts
+    return jsonify({
+        str(court): [{'start_time': format_minutes(start), 'end_time': format_minutes(end)}
+                     for start, end in repository.free_slots(court, date)]
+        for court in courts
+    })
+
+# How long a disconnected EventSource waits before reconnecting
+SSE_RETRY_MS = 3000
+
+@app.route('/events')
+def events():
+    # Browsers resume with Last-Event-ID; other clients can pass ?after=
+    last_seen = request.headers.get('Last-Event-ID') or request.args.get('after')
+    try:
+        after_id = int(last_seen) if last_seen else None
+    except ValueError:
+        return jsonify({'error': 'Invalid event id'}), 400
+    date = parse_date(request.args.get('date'))
+    date = date.isoformat() if date else None
+
+    def stream():
+        yield f'retry: {SSE_RETRY_MS}\n\n'
+        for kind, event_id, delta in repository.events.follow(after_id, date=date):
+            if kind == 'delta':
+                yield f"id: {event_id}\ndata: {json.dumps(delta, separators=(',', ':'))}\n\n"
+            elif kind == 'reset':
+                yield f'event: reset\nid: {event_id}\ndata: {{}}\n\n'
+            else:
+                yield ': keep-alive\n\n'
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/availability/<date_str>')
+def availability(date_str):
+    date = parse_date(date_str)
+    if date is None:
+        return jsonify({'error': 'Invalid date, expected YYYY-MM-DD'}), 400
+    return jsonify(repository.day_grid(date).to_dict())
+
+def parse_time_of_day(value):
+    """Zero-padded 'HH:MM' for a query parameter, None if absent; raises ValueError if malformed"""
+    return datetime.strptime(value, '%H:%M').strftime('%H:%M') if value else None
+
+@app.route('/api/earliest-slots')
+def earliest_slots():
+    # e.g. /api/earliest-slots?courts=1,3&from=17:00&to=21:00&min_free=2&limit=5
+    try:
+        courts = request.args.get('courts')
+        courts = {int(court) for court in courts.split(',')} if courts else None
+        slots = repository.find_earliest_slots(
+            courts,
+            earliest=parse_time_of_day(request.args.get('from')),
+            latest=parse_time_of_day(request.args.get('to')),
+            min_free=int(request.args.get('min_free', 1)),
+            limit=min(int(request.args.get('limit', 5)), 100),
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(slots)
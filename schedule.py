@@ -0,0 +1,212 @@
+import threading
+from datetime import date as Date, datetime, time, timedelta
+from database import SESSION_CAPACITY
+from timecodes import format_minutes, from_day, to_day, to_minutes
+
+# Bookable day, in minutes since midnight, split into fixed-length slots
+DAY_START = 7 * 60
+DAY_END = 23 * 60
+SLOT_MINUTES = 120
+
+# Sessions can be booked at most this many days ahead
+BOOKING_WINDOW_DAYS = 7
+
+# Most bookings one recurring or multi-slot series may make
+MAX_SERIES = 100
+
+# Most weeks a series can repeat for; a later week would start beyond the booking window
+MAX_SERIES_WEEKS = (BOOKING_WINDOW_DAYS - 1) // 7 + 1
+
+
+def time_slots():
+    """(start, end) 'HH:MM' pairs for every bookable slot in a day"""
+    return [(format_minutes(start), format_minutes(start + SLOT_MINUTES))
+            for start in range(DAY_START, DAY_END - SLOT_MINUTES + 1, SLOT_MINUTES)]
+
+
+def check_booking_window(date, start_time, now=None):
+    """Raise ValueError unless a session starting at `date` `start_time` is bookable at `now`"""
+    now = now or datetime.now()
+    starts_at = datetime.combine(from_day(to_day(date)), time()) + timedelta(minutes=to_minutes(start_time))
+    if starts_at < now:
+        raise ValueError("Cannot book sessions in the past")
+    if starts_at > now + timedelta(days=BOOKING_WINDOW_DAYS):
+        raise ValueError("Cannot book sessions more than a week in advance")
+
+
+def series_slots(court_ids, date, start_time, slots=1, weeks=1):
+    """(court, date, start minute) for `slots` consecutive slots on each court, repeated weekly for `weeks`"""
+    if not court_ids or slots < 1 or weeks < 1:
+        raise ValueError("A series needs at least one court, slot and week")
+    if weeks > MAX_SERIES_WEEKS:
+        raise ValueError(f"A series can repeat for at most {MAX_SERIES_WEEKS} week(s); "
+                         f"sessions open for booking only {BOOKING_WINDOW_DAYS} days ahead")
+    if len(court_ids) * slots * weeks > MAX_SERIES:
+        raise ValueError(f"A series can make at most {MAX_SERIES} bookings")
+    if isinstance(date, str):
+        date = Date.fromisoformat(date)
+    start = to_minutes(start_time)
+    return [(court_id, date + timedelta(weeks=week), start + slot * SLOT_MINUTES)
+            for week in range(weeks) for slot in range(slots) for court_id in court_ids]
+
+
+class DayGrid:
+    """Dense slot x court occupancy matrix for one date"""
+
+    def __init__(self, date, courts, slots, capacity=SESSION_CAPACITY):
+        self.date = date
+        self.courts = courts
+        self.slots = slots
+        self.capacity = capacity
+        self.booked = [[0] * len(courts) for _ in slots]
+        self.pending = [[0] * len(courts) for _ in slots]  # Open waiting-list offers
+        self.waiting = [[0] * len(courts) for _ in slots]
+        self.available = [[False] * len(courts) for _ in slots]  # Whether the session exists
+
+    def cell(self, slot_index, court_index):
+        """(places taken by bookings and open offers, waiting) for one slot and court"""
+        return (self.booked[slot_index][court_index] + self.pending[slot_index][court_index],
+                self.waiting[slot_index][court_index])
+
+    def free(self, slot_index, court_index):
+        taken = self.booked[slot_index][court_index] + self.pending[slot_index][court_index]
+        return max(0, self.capacity - taken)
+
+    def is_available(self, slot_index, court_index):
+        """Whether a session has been generated for this slot and court, so it can be booked"""
+        return self.available[slot_index][court_index]
+
+    def is_full(self, slot_index, court_index):
+        return self.free(slot_index, court_index) == 0
+
+    def free_ranges(self, court_index):
+        """(start, end) minute ranges on one court with room, merged across adjacent slots"""
+        ranges = []
+        for i, (start, end) in enumerate(self.slots):
+            if not self.is_available(i, court_index) or self.is_full(i, court_index):
+                continue
+            start, end = to_minutes(start), to_minutes(end)
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+        return ranges
+
+    def to_dict(self):
+        return {
+            'date': str(self.date),
+            'capacity': self.capacity,
+            'courts': self.courts,
+            'slots': [{'start_time': start, 'end_time': end} for start, end in self.slots],
+            'booked': self.booked,
+            'pending': self.pending,
+            'waiting': self.waiting,
+            'available': self.available,
+        }
+
+
+def build_day_grid(db, date):
+    """Fill a DayGrid for `date` from one query over the courts and that day's sessions"""
+    return build_grids(db, date, 1)[0]
+
+
+def build_grids(db, start_date, days):
+    """DayGrids for `days` consecutive dates from one query over courts and sessions"""
+    if isinstance(start_date, str):
+        start_date = Date.fromisoformat(start_date)
+    slots = time_slots()
+    slot_index = {to_minutes(start): i for i, (start, _) in enumerate(slots)}
+    dates = [start_date + timedelta(days=offset) for offset in range(days)]
+    first_day = to_day(start_date)
+
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT c.court_number, s.day, s.start_minute, s.booked_count, s.waiting_count, (
+                SELECT COUNT(*) FROM bookings
+                WHERE session_id = s.id AND status = 'pending_confirmation'
+            )
+            FROM courts c
+            LEFT JOIN sessions s ON s.court_id = c.id AND s.day BETWEEN ? AND ?
+            ORDER BY c.court_number
+        ''', (first_day, first_day + days - 1))
+        rows = cursor.fetchall()
+
+    courts = list(dict.fromkeys(row[0] for row in rows))
+    court_index = {court: i for i, court in enumerate(courts)}
+    grids = [DayGrid(date, courts, slots) for date in dates]
+    for court, day, start_minute, booked, waiting, pending in rows:
+        i = slot_index.get(start_minute)
+        if day is not None and i is not None:
+            d = day - first_day
+            grids[d].booked[i][court_index[court]] = booked
+            grids[d].pending[i][court_index[court]] = pending
+            grids[d].waiting[i][court_index[court]] = waiting
+            grids[d].available[i][court_index[court]] = True
+    return grids
+
+
+class WeekOccupancy:
+    """Day grids for the whole booking window, reloaded only when occupancy changes.
+
+    The grids are read with one query and kept until the database's
+    occupancy version moves or the window rolls over to a new day, so
+    repeated searches cost a single counter lookup plus an in-memory scan.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._key = None
+        self._grids = None
+        self._lock = threading.Lock()
+
+    def grids(self, today):
+        """One DayGrid per date from `today` to the end of the booking window"""
+        key = (today, self.db.occupancy_version())
+        with self._lock:
+            if key != self._key:
+                self._grids = build_grids(self.db, today, BOOKING_WINDOW_DAYS + 1)
+                self._key = key
+            return self._grids
+
+    def find_earliest_slots(self, courts=None, earliest=None, latest=None, min_free=1, limit=5, now=None):
+        """The `limit` earliest bookable slots with at least `min_free` open places.
+
+        Only slots that start between `now` and the end of the booking window
+        are considered, optionally restricted to a set of court numbers and to
+        slots lying within the 'HH:MM' bounds `earliest` and `latest`. Results
+        come back in (date, start time, court) order.
+        """
+        if min_free < 1 or min_free > SESSION_CAPACITY:
+            raise ValueError(f"min_free must be between 1 and {SESSION_CAPACITY}")
+        now = now or datetime.now()
+        horizon = now + timedelta(days=BOOKING_WINDOW_DAYS)
+        max_taken = SESSION_CAPACITY - min_free
+
+        grids = self.grids(now.date())
+        wanted = [j for j, court in enumerate(grids[0].courts) if courts is None or court in courts]
+        slots = [(i, start, end, timedelta(hours=int(start[:2]), minutes=int(start[3:])))
+                 for i, (start, end) in enumerate(grids[0].slots)
+                 if (earliest is None or start >= earliest) and (latest is None or end <= latest)]
+
+        results = []
+        for grid in grids:
+            date, midnight = str(grid.date), datetime.combine(grid.date, datetime.min.time())
+            for i, start, end, offset in slots:
+                starts_at = midnight + offset
+                if starts_at < now:
+                    continue
+                if starts_at > horizon:
+                    return results
+                booked, pending, available = grid.booked[i], grid.pending[i], grid.available[i]
+                for j in wanted:
+                    if not available[j]:
+                        continue
+                    # Open waiting-list offers hold their places until they are answered
+                    taken = booked[j] + pending[j]
+                    if taken <= max_taken:
+                        results.append({'date': date, 'court': grid.courts[j], 'start_time': start,
+                                        'end_time': end, 'free': grid.capacity - taken})
+                        if len(results) >= limit:
+                            return results
+        return results
@@ -0,0 +1,34 @@
+from datetime import date, datetime
+from functools import lru_cache
+
+# Sessions store dates as day numbers (proleptic Gregorian ordinals, as in
+# date.toordinal()) and times as minutes since midnight, so range checks are
+# integer comparisons and nothing is parsed per row.
+
+
+def to_day(value):
+    """Day number for a date, datetime or 'YYYY-MM-DD' string"""
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    elif isinstance(value, datetime):
+        value = value.date()
+    return value.toordinal()
+
+
+def from_day(day):
+    return date.fromordinal(day)
+
+
+def to_minutes(value):
+    """Minutes since midnight for a datetime.time, datetime or 'HH:MM' string"""
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        hours, minutes = value.split(':')[:2]
+        return int(hours) * 60 + int(minutes)
+    return value.hour * 60 + value.minute
+
+
+@lru_cache(maxsize=2048)
+def format_minutes(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
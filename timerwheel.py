@@ -0,0 +1,68 @@
+import math
+import threading
+
+
+class TimerWheel:
+    """Hashed timing wheel of one-shot deadlines keyed by an id.
+
+    schedule() and cancel() are O(1); advance() only visits the buckets for
+    the ticks that elapsed, so the cost of expiry does not grow with the
+    number of pending timers. Deadlines further out than one revolution keep
+    their absolute tick and simply stay put until their turn comes round.
+    """
+
+    def __init__(self, tick=1.0, size=512):
+        self.tick = tick
+        self.size = size
+        self._buckets = [{} for _ in range(size)]  # key -> (tick, deadline)
+        self._where = {}  # key -> bucket index
+        self._current = None  # Last tick processed by advance()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._where)
+
+    def _tick_of(self, moment):
+        # Round up so a timer never fires before its deadline
+        return math.ceil(moment.timestamp() / self.tick)
+
+    def schedule(self, key, deadline):
+        """Fire `key` on the first advance() at or after `deadline`, replacing any earlier timer"""
+        with self._lock:
+            self._cancel(key)
+            tick = self._tick_of(deadline)
+            if self._current is not None and tick <= self._current:
+                tick = self._current + 1
+            bucket = tick % self.size
+            self._buckets[bucket][key] = (tick, deadline)
+            self._where[key] = bucket
+
+    def _cancel(self, key):
+        bucket = self._where.pop(key, None)
+        if bucket is not None:
+            del self._buckets[bucket][key]
+
+    def cancel(self, key):
+        with self._lock:
+            self._cancel(key)
+
+    def advance(self, now):
+        """Remove and return the keys whose deadline is at or before `now`, earliest first"""
+        target = math.floor(now.timestamp() / self.tick)
+        with self._lock:
+            if self._current is None or target - self._current >= self.size:
+                buckets = range(self.size)
+            else:
+                buckets = [tick % self.size for tick in range(self._current + 1, target + 1)]
+            self._current = max(target, self._current or target)
+
+            expired = []
+            for index in buckets:
+                bucket = self._buckets[index]
+                due = [(deadline, key) for key, (tick, deadline) in bucket.items() if tick <= target]
+                for deadline, key in due:
+                    del bucket[key]
+                    del self._where[key]
+                expired.extend(due)
+            expired.sort(key=lambda item: item[0])
+            return [key for _, key in expired]
@@ -0,0 +1,76 @@
+import random
+from datetime import datetime, timedelta
+from database import SESSION_CAPACITY
+from schedule import time_slots
+from timecodes import to_day
+
+NOTIFICATION_TYPES = ('booking_confirmation', 'late_warning', 'fine_notice', 'waiting_list_notification')
+
+# Outcome weights for bookings in sessions that already took place
+PAST_STATUSES = (('booked', 0.85), ('late', 0.10), ('no_show', 0.05))
+
+
+def generate_workload(db, players=1000, courts=6, past_weeks=1, weeks=2, fill=0.6, oversubscribed=0.15,
+                      max_waiting=5, notifications_per_player=5, seed=0, today=None, password='secret1'):
+    """Fill `db` with a reproducible synthetic booking history and return the row counts.
+
+    Sessions cover `past_weeks` before and `weeks` from `today`. Each place in
+    a session is booked with probability `fill`; an `oversubscribed` share of
+    sessions is full with up to `max_waiting` players on the waiting list.
+    Past bookings get late/no-show outcomes. The same seed always yields the
+    same rows.
+    """
+    from hashing import hasher
+
+    rng = random.Random(seed)
+    today = today or datetime.now().date()
+    start = today - timedelta(weeks=past_weeks)
+    dates = [start + timedelta(days=offset) for offset in range((past_weeks + weeks) * 7)]
+    # One real hash shared by every player keeps generation fast but logins realistic
+    password_hash = hasher.hash(password)
+
+    with db.transaction() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('INSERT OR IGNORE INTO courts (court_number) VALUES (?)',
+                           [(n,) for n in range(1, courts + 1)])
+        cursor.execute('SELECT MAX(id) FROM players')
+        first = (cursor.fetchone()[0] or 0) + 1
+        cursor.executemany('INSERT INTO players (name, email, password) VALUES (?, ?, ?)',
+                           [(f"Player {i}", f"player{i}@example.com", password_hash)
+                            for i in range(first, first + players)])
+        cursor.execute('SELECT id FROM players WHERE id >= ? ORDER BY id', (first,))
+        player_ids = [row[0] for row in cursor.fetchall()]
+
+        db.generate_sessions(dates, time_slots())
+        cursor.execute('''
+            SELECT id, day FROM sessions WHERE day BETWEEN ? AND ? ORDER BY id
+        ''', (to_day(dates[0]), to_day(dates[-1])))
+        sessions = cursor.fetchall()
+
+        bookings, waiting = [], []
+        statuses, weights = zip(*PAST_STATUSES)
+        for session_id, day in sessions:
+            past = day < to_day(today)
+            if rng.random() < oversubscribed:
+                chosen = rng.sample(player_ids, min(len(player_ids), SESSION_CAPACITY + rng.randint(1, max_waiting)))
+            else:
+                places = sum(rng.random() < fill for _ in range(SESSION_CAPACITY))
+                chosen = rng.sample(player_ids, min(len(player_ids), places))
+            for player_id in chosen[:SESSION_CAPACITY]:
+                status = rng.choices(statuses, weights)[0] if past else 'booked'
+                bookings.append((player_id, session_id, status))
+            waiting += [(player_id, session_id, position)
+                        for position, player_id in enumerate(chosen[SESSION_CAPACITY:], 1)]
+
+        cursor.executemany('INSERT INTO bookings (player_id, session_id, status) VALUES (?, ?, ?)', bookings)
+        cursor.executemany('INSERT INTO waiting_list (player_id, session_id, position) VALUES (?, ?, ?)', waiting)
+
+        notifications = [(rng.choice(player_ids), kind, f"Synthetic {kind}", 'sent')
+                         for kind in (rng.choice(NOTIFICATION_TYPES)
+                                      for _ in range(players * notifications_per_player))]
+        cursor.executemany('''
+            INSERT INTO notifications (player_id, type, message, status) VALUES (?, ?, ?, ?)
+        ''', notifications)
+
+    return {'players': players, 'sessions': len(sessions), 'bookings': len(bookings),
+            'waiting': len(waiting), 'notifications': len(notifications)}